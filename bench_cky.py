@@ -0,0 +1,308 @@
+'''Benchmark the parsers as sentences and grammars grow
+
+Synthetic grammars in Chomsky Normal Form are generated with a given
+number of non-terminals, binary rules per non-terminal, words, and
+categories per word (the lexical ambiguity).  Sentences of each length
+are sampled from them, top down.  The hw2_5 sentences over grammar2
+are run too.
+
+Each engine parses every sentence, one at a time, and for each
+(grammar, engine, length) the throughput, the latency percentiles and
+the peak memory of a parse (by tracemalloc, in a separate pass) are
+recorded.  The engines are CKY.parse and CKY.recognise from cky_5, the
+recognisers in cky.py, cky_3.py and cky_4.py, and NLTK's ChartParser.
+An engine stops getting longer sentences once the median parse takes
+more than --budget seconds, or any one parse more than --timeout
+seconds (where there is a SIGALRM to stop it with), which matters for
+the old recognisers, as some of them blow up on ambiguous grammars.
+
+The results, and the exponents of a log-log fit of median latency
+against sentence length and against grammar size, which should come
+out near 3 and 1 for CKY, go to a JSON file.
+
+Usage: python bench_cky.py [--out FILE] [--lengths N ...]
+         [--nonterminals N ...] [--size-length N] [--sentences N]
+         [--budget SECONDS] [--timeout SECONDS]
+'''
+import argparse,json,math,platform,random,signal,sys,time,tracemalloc
+from cky_stats import percentile
+from cky_stream import tokenise
+
+# grammar2 and its sentences, from hw2_5
+GRAMMAR2='''
+S -> Sdecl '.' | Simp '.' | Sq '?'
+Sdecl -> NP VP
+Simp -> VP
+Sq -> Sqyn | Swhadv
+Sqyn -> Mod Sdecl | Aux Sdecl
+Swhadv -> WhAdv Sqyn
+Sc -> Subconj Sdecl
+NP -> PropN | Pro | NP0
+NP0 -> NP1 | NP0 PP
+NP1 -> Det N2sc | N2mp | Sc
+N2sc -> Adj N2sc | Nsc | N3 Nsc
+N2mp -> Adj N2mp | Nmp | N3 Nmp
+N3 -> N | N3 N
+N -> Nsc | Nmp
+VP -> VPi | VPt | VPdt | Mod VP | VP Adv | VP PP
+VPi -> Vi
+VPt -> Vt NP
+VPdt -> VPo PP
+VPdt -> VPio NP
+VPo -> Vdt NP
+VPio -> Vdt NP
+PP -> Prep NP
+Det -> 'a' | 'the'
+Nmp -> 'salad' | 'mushrooms'
+Nsc -> 'book' | 'fork' | 'flight' | 'salad' | 'drawing'
+Prep -> 'to' | 'with'
+Vi -> 'ate'
+Vt -> 'ate' | 'book' | 'Book' | 'gave' | 'told'
+Vdt -> 'gave' | 'told'
+Subconj -> 'that'
+Mod -> 'Can' | 'will'
+Aux -> 'did'
+WhAdv -> 'Why'
+PropN -> 'John' | 'Mary' | 'NYC' | 'London'
+Adj -> 'nice' | 'drawing'
+Pro -> 'you' | 'he'
+Adv -> 'today'
+'''
+
+SENTENCES2=["John gave a book to Mary.",
+            "John gave Mary a book.",
+            "John gave Mary a nice drawing book.",
+            "John ate salad with mushrooms with a fork.",
+            "Book a flight to NYC.",
+            "Can you book a flight to London?",
+            "Why did John book the flight?",
+            "John told Mary that he will book a flight today."]
+
+def syntheticGrammar(nonterminals=10,binary=3,words=50,ambiguity=2,seed=0):
+    '''The text of a random grammar in Chomsky Normal Form
+
+    The non-terminals are S and X0 ... X(nonterminals-1), each with
+    binary rules over random Xs, and each of the words w0 ... gets
+    ambiguity lexical categories among the Xs.  Every X has at least
+    one word, so every non-terminal covers sentences of any length
+    (S of any length from 2).
+
+    :type nonterminals: int
+    :param nonterminals: how many non-terminals besides S
+    :type binary: int
+    :param binary: binary rules for each non-terminal
+    :type words: int
+    :param words: size of the vocabulary, at least nonterminals
+    :type ambiguity: int
+    :param ambiguity: categories for each word
+    :rtype: str'''
+    rnd=random.Random(seed)
+    xs=["X%d"%i for i in range(nonterminals)]
+    lines=[]
+    for lhs in ['S']+xs:
+        rules=set()
+        while len(rules)<min(binary,nonterminals*nonterminals):
+            rules.add((rnd.choice(xs),rnd.choice(xs)))
+        lines.append("%s -> %s"%(lhs," | ".join("%s %s"%r for r in sorted(rules))))
+    for i in range(words):
+        categories=set([xs[i%nonterminals]])
+        while len(categories)<min(ambiguity,nonterminals):
+            categories.add(rnd.choice(xs))
+        for x in sorted(categories):
+            lines.append("%s -> 'w%d'"%(x,i))
+    return '\n'.join(lines)+'\n'
+
+def sampleSentence(compiled,length,rnd):
+    '''A random sentence of exactly length words from a grammar made
+    by syntheticGrammar, derived top down from S'''
+    binary=dict((lhs,[]) for lhs in compiled.nonterminalIds.values())
+    lexical=dict((lhs,[]) for lhs in compiled.nonterminalIds.values())
+    for key,parents in compiled.binary.items():
+        children=compiled.unpack(key)
+        for parent in parents:
+            binary[parent].append(children)
+    for child,parents in compiled.unary.items():
+        for parent in parents:
+            lexical[parent].append(child)
+    words=[]
+    # (symbol, length) still to expand, leftmost last
+    agenda=[(compiled.start,length)]
+    while agenda:
+        symbol,n=agenda.pop()
+        if n==1:
+            words.append(compiled.name(rnd.choice(lexical[symbol])))
+            continue
+        left,right=rnd.choice(binary[symbol])
+        mid=rnd.randint(1,n-1)
+        agenda.append((right,n-mid))
+        agenda.append((left,mid))
+    return words
+
+def engines(text):
+    '''(name, parse function) for each engine, over the grammar text'''
+    import nltk
+    from cfg_fix import parse_grammar
+    import cky,cky_3,cky_4,cky_5
+    from cky_grammar import readGrammar
+    cfg=parse_grammar(text)
+    new=cky_5.CKY(readGrammar(text))
+    return [("cky_5.parse",new.parse),
+            ("cky_5.recognise",new.recognise),
+            ("cky.recognise",cky.CKY(cfg).recognise),
+            ("cky_3.recognise",cky_3.CKY(cfg).recognise),
+            ("cky_4.recognise",cky_4.CKY(cfg).recognise),
+            ("nltk.ChartParser",nltk.ChartParser(cfg).chart_parse)]
+
+class Timeout(Exception):
+    pass
+
+def alarm(signum,frame):
+    raise Timeout()
+
+def limited(parse,tokens,timeout):
+    '''parse(tokens), raising Timeout if it takes over timeout seconds'''
+    if not hasattr(signal,'SIGALRM'):
+        return parse(tokens)
+    previous=signal.signal(signal.SIGALRM,alarm)
+    signal.setitimer(signal.ITIMER_REAL,timeout)
+    try:
+        return parse(tokens)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL,0)
+        signal.signal(signal.SIGALRM,previous)
+
+def measure(parse,sentences,timeout):
+    '''Time parse over sentences, then find its peak memory
+
+    :rtype: dict
+    :return: the measurements, or None if a parse timed out'''
+    latencies=[]
+    try:
+        for tokens in sentences:
+            start=time.perf_counter()
+            limited(parse,tokens,timeout)
+            latencies.append(time.perf_counter()-start)
+        peak=0
+        for tokens in sentences:
+            tracemalloc.start()
+            try:
+                limited(parse,tokens,timeout)
+                peak=max(peak,tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+    except Timeout:
+        return None
+    total=sum(latencies)
+    return {"sentences":len(sentences),
+            "words":sum(len(t) for t in sentences),
+            "seconds":total,
+            "sentencesPerSecond":len(sentences)/total,
+            "wordsPerSecond":sum(len(t) for t in sentences)/total,
+            "p50":percentile(latencies,50),
+            "p90":percentile(latencies,90),
+            "p99":percentile(latencies,99),
+            "peakMemory":peak}
+
+def exponent(points):
+    '''The slope of a least-squares fit of log y against log x'''
+    points=[(math.log(x),math.log(y)) for x,y in points if x>0 and y>0]
+    if len(points)<2:
+        return None
+    mx=sum(x for x,y in points)/len(points)
+    my=sum(y for x,y in points)/len(points)
+    sxx=sum((x-mx)**2 for x,y in points)
+    if sxx==0:
+        return None
+    return sum((x-mx)*(y-my) for x,y in points)/sxx
+
+def run(grammarName,text,groups,budget,timeout,results,log):
+    '''Measure every engine on each (length, sentences) group, shortest
+    first, adding a record to results for each, which only says
+    timedOut if a parse took too long'''
+    from cky_grammar import readGrammar
+    compiled=readGrammar(text)
+    rules=sum(len(parents) for parents in compiled.unary.values())
+    rules+=sum(len(parents) for parents in compiled.binary.values())
+    for name,parse in engines(text):
+        for length,sentences in groups:
+            record=measure(parse,sentences,timeout)
+            if record is None:
+                results.append({"grammar":grammarName,"rules":rules,"engine":name,
+                                "length":length,"timedOut":True})
+                log("%-12s %5d rules  %-17s n=%-3s timed out"%(grammarName,rules,name,length))
+                break
+            record.update(grammar=grammarName,rules=rules,engine=name,length=length)
+            results.append(record)
+            log("%-12s %5d rules  %-17s n=%-3s %9.2f ms p50 %9.2f ms p99 %9.0f KiB"%(
+                grammarName,rules,name,length,1000*record["p50"],1000*record["p99"],
+                record["peakMemory"]/1024.0))
+            if record["p50"]>budget:
+                break
+
+def scaling(results,over):
+    '''Fitted exponents of median latency against over ('length' or 'rules')
+
+    The other one is held fixed: lengths are compared within a grammar,
+    and grammar sizes at one length over the "size" grammars.'''
+    fits=[]
+    if over=='length':
+        keys=sorted(set((r["grammar"],r["engine"]) for r in results if r["grammar"]!="grammar2"))
+        for grammar,engine in keys:
+            points=[(r["length"],r["p50"]) for r in results
+                    if r["grammar"]==grammar and r["engine"]==engine and "p50" in r]
+            fits.append({"grammar":grammar,"engine":engine,"over":over,"exponent":exponent(points)})
+    else:
+        sized=[r for r in results if r["grammar"].startswith("size")]
+        for engine in sorted(set(r["engine"] for r in sized)):
+            points=[(r["rules"],r["p50"]) for r in sized if r["engine"]==engine and "p50" in r]
+            fits.append({"grammar":"size*","engine":engine,"over":over,"exponent":exponent(points)})
+    return fits
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out',default='bench_cky.json',help='where to write the results')
+    parser.add_argument('--lengths',type=int,nargs='+',default=[4,6,8,12,16,24,32,48])
+    parser.add_argument('--nonterminals',type=int,nargs='+',default=[8,16,32,48,64],
+                        help='grammar sizes to try at --size-length words')
+    parser.add_argument('--size-length',type=int,default=12)
+    parser.add_argument('--sentences',type=int,default=5,help='sentences per length')
+    parser.add_argument('--budget',type=float,default=1.0,
+                        help='give an engine no longer sentences once its median parse takes this long')
+    parser.add_argument('--timeout',type=float,default=10.0,
+                        help='give up on an engine for longer sentences once a parse takes this long')
+    args=parser.parse_args()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(),10000))
+    from cky_grammar import readGrammar
+    def log(message):
+        print(message)
+        sys.stdout.flush()
+    results=[]
+    rnd=random.Random(0)
+    byLength={}
+    for s in SENTENCES2:
+        tokens=tokenise(s)
+        byLength.setdefault(len(tokens),[]).append(tokens)
+    run("grammar2",GRAMMAR2,sorted(byLength.items()),args.budget,args.timeout,results,log)
+    text=syntheticGrammar(nonterminals=12,binary=4,words=60,ambiguity=2)
+    compiled=readGrammar(text)
+    groups=[(n,[sampleSentence(compiled,n,rnd) for i in range(args.sentences)])
+            for n in args.lengths]
+    run("length",text,groups,args.budget,args.timeout,results,log)
+    for k in args.nonterminals:
+        text=syntheticGrammar(nonterminals=k,binary=k//2,words=4*k,ambiguity=2,seed=k)
+        compiled=readGrammar(text)
+        groups=[(args.size_length,[sampleSentence(compiled,args.size_length,rnd)
+                                   for i in range(args.sentences)])]
+        run("size%d"%k,text,groups,args.budget,args.timeout,results,log)
+    fits=scaling(results,'length')+scaling(results,'rules')
+    for fit in fits:
+        if fit["exponent"] is not None:
+            log("%-8s %-17s latency ~ %s^%.2f"%(fit["grammar"],fit["engine"],fit["over"],fit["exponent"]))
+    with open(args.out,'w') as f:
+        json.dump({"python":platform.python_version(),
+                   "platform":platform.platform(),
+                   "time":time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   "arguments":vars(args),
+                   "results":results,
+                   "scaling":fits},f,indent=1)
+    log("results in %s"%args.out)
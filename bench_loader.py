@@ -0,0 +1,50 @@
+'''Benchmark grammar loading on a large generated lexicon
+
+Compares cfg_fix.parse_grammar (CFG.fromstring, with an eval per
+terminal) followed by compiling the productions, against
+cky_grammar.readGrammar, which goes straight from text to a
+CompiledGrammar, at several lexicon sizes.
+
+Usage: python bench_loader.py [lexical rules ...]
+'''
+import random,sys,time
+
+CORE='''S -> NP VP
+NP -> Det N | N | NP PP
+VP -> V | V NP | VP PP
+PP -> P NP
+'''
+
+def lexicon(n,seed=0):
+    '''A grammar with CORE and n lexical rules, a few alternatives per line'''
+    rnd=random.Random(seed)
+    lines=[CORE]
+    words=["w%d"%i for i in range(n)]
+    for i in range(0,n,4):
+        lhs=rnd.choice(('N','V','Det','P'))
+        lines.append("%s -> %s"%(lhs," | ".join("'%s'"%w for w in words[i:i+4])))
+    return '\n'.join(lines)
+
+def timed(f,*args):
+    start=time.time()
+    result=f(*args)
+    return time.time()-start,result
+
+def nltkLoad(text):
+    import cfg_fix
+    from cky_grammar import CompiledGrammar
+    grammar=cfg_fix.parse_grammar(text)
+    return CompiledGrammar(grammar.productions(),grammar.start())
+
+if __name__=='__main__':
+    sizes=[int(a) for a in sys.argv[1:]] or [10000,100000]
+    from cky_grammar import readGrammar
+    import cfg_fix
+    for n in sizes:
+        text=lexicon(n)
+        fromstring,grammar=timed(cfg_fix.parse_grammar,text)
+        old,a=timed(nltkLoad,text)
+        new,b=timed(readGrammar,text)
+        assert a.names==b.names and a.unary==b.unary and a.binary==b.binary
+        print("%7d rules: CFG.fromstring %7.0f ms, + compile %7.0f ms, readGrammar %7.0f ms (%.1fx)"%(
+            len(grammar.productions()),1000*fromstring,1000*old,1000*new,old/new))
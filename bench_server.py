@@ -0,0 +1,88 @@
+'''Benchmark cky_server against starting a process per sentence
+
+Starts cky_server on a Unix socket with grammar2, and sends it the
+hw2_5 sentences over and over, from several connections at once, each
+keeping a few requests in flight, first with its result cache off, so
+every request is parsed, and then with it on.  Then parses a few of
+them with a fresh "python cky_stream.py" each, as a hw2_5-style script
+would be run, and prints the throughput of all three.
+
+Usage: python bench_server.py [requests [connections [workers]]]
+'''
+import asyncio,json,os,subprocess,sys,tempfile,time
+
+from bench_cky import GRAMMAR2,SENTENCES2
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+
+async def client(path,sentences,depth,latencies):
+    '''Send sentences down one connection, at most depth at a time'''
+    reader,writer=await asyncio.open_unix_connection(path)
+    sent={}
+    async def receive():
+        reply=json.loads((await reader.readline()).decode('utf-8'))
+        assert "error" not in reply,reply
+        latencies.append(time.time()-sent.pop(reply["id"]))
+    for i,sentence in enumerate(sentences):
+        while len(sent)>=depth:
+            await receive()
+        sent[i]=time.time()
+        writer.write((json.dumps({"id":i,"sentence":sentence})+'\n').encode('utf-8'))
+        await writer.drain()
+    while sent:
+        await receive()
+    writer.write((json.dumps({"id":"m","op":"metrics"})+'\n').encode('utf-8'))
+    metrics=json.loads((await reader.readline()).decode('utf-8'))
+    writer.close()
+    return metrics
+
+async def load(path,requests,connections,depth=8):
+    '''Run the clients, returning (seconds, latencies, server metrics)'''
+    share=[[SENTENCES2[(i*connections+c)%len(SENTENCES2)]
+            for i in range(requests//connections)] for c in range(connections)]
+    latencies=[]
+    start=time.time()
+    metrics=await asyncio.gather(*[client(path,s,depth,latencies) for s in share])
+    return time.time()-start,latencies,metrics[-1]
+
+def waitFor(path,process,limit=30):
+    start=time.time()
+    while not os.path.exists(path):
+        if process.poll() is not None or time.time()-start>limit:
+            raise RuntimeError("cky_server did not start")
+        time.sleep(0.05)
+
+if __name__=='__main__':
+    requests=int(sys.argv[1]) if len(sys.argv)>1 else 4000
+    connections=int(sys.argv[2]) if len(sys.argv)>2 else 8
+    workers=sys.argv[3] if len(sys.argv)>3 else str(os.cpu_count() or 1)
+    tmp=tempfile.mkdtemp()
+    grammar=os.path.join(tmp,'grammar2.cfg')
+    with open(grammar,'w') as f:
+        f.write(GRAMMAR2)
+    for results in ('0','10000'):
+        path=os.path.join(tmp,'cky%s.sock'%results)
+        server=subprocess.Popen([sys.executable,os.path.join(HERE,'cky_server.py'),grammar,
+                                 '--unix',path,'--workers',workers,'--results',results],
+                                cwd=HERE,stdout=subprocess.DEVNULL)
+        try:
+            waitFor(path,server)
+            loop=asyncio.new_event_loop()
+            seconds,latencies,metrics=loop.run_until_complete(load(path,requests,connections))
+            loop.close()
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        print("server, %s workers, %s results cached: %d requests in %.2f s, %.0f/s, p50 %.1f ms, p99 %.1f ms, mean batch %s"%(
+            workers,results,len(latencies),seconds,len(latencies)/seconds,
+            1000*latencies[len(latencies)//2],1000*latencies[int(len(latencies)*0.99)],
+            "%.1f"%metrics["meanBatch"] if metrics["meanBatch"] else "-"))
+    runs=20
+    start=time.time()
+    for i in range(runs):
+        subprocess.run([sys.executable,os.path.join(HERE,'cky_stream.py'),grammar],
+                       input=SENTENCES2[i%len(SENTENCES2)],universal_newlines=True,
+                       cwd=HERE,stdout=subprocess.DEVNULL,check=True)
+    seconds=time.time()-start
+    print("process per request: %d requests in %.2f s, %.1f/s"%(runs,seconds,runs/seconds))
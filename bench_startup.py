@@ -0,0 +1,66 @@
+'''Benchmark cold-start time: importing cky_5 and parsing a first sentence
+
+Each case runs in a fresh interpreter, several times, and the median
+wall time is reported.
+
+Usage: python bench_startup.py [runs]
+'''
+import os,subprocess,sys,tempfile,time
+
+GRAMMAR='''
+S -> NP VP
+NP -> Det Nom | Nom | NP PP
+Det -> NP "'s"
+Nom -> N SRel | N
+VP -> Vi | Vt NP | VP PP
+PP -> Prep NP
+SRel -> Relpro VP
+Det -> 'a' | 'the'
+N -> 'fish' | 'frogs' | 'soup' | 'children' | 'books'
+Prep -> 'in' | 'for'
+Vt -> 'saw' | 'ate' | 'read'
+Vi -> 'fish' | 'swim'
+Relpro -> 'that'
+'''
+
+SENTENCE="the children ate the soup".split()
+
+CASES=[
+    ("import cky_5",
+     "import cky_5"),
+    ("import cky_5, load cached grammar, parse",
+     "import cky_5, cky_grammar\n"
+     "c=cky_5.CKY(cky_grammar.loadGrammar(GRAMMAR,CACHE))\n"
+     "assert c.recognise(SENTENCE)"),
+    ("import cky_5, parse_grammar, parse",
+     "import cky_5, cfg_fix\n"
+     "c=cky_5.CKY(cfg_fix.parse_grammar(GRAMMAR))\n"
+     "assert c.recognise(SENTENCE)"),
+    ("as above, with nltk.draw imported (the old start-up)",
+     "import cky_5, cfg_fix\n"
+     "cfg_fix.fix_cfg_editor()\n"
+     "c=cky_5.CKY(cfg_fix.parse_grammar(GRAMMAR))\n"
+     "assert c.recognise(SENTENCE)"),
+]
+
+def timeCase(code,cache,runs):
+    '''Median wall time in seconds of running code in a fresh python'''
+    prelude="GRAMMAR=%r\nSENTENCE=%r\nCACHE=%r\n"%(GRAMMAR,SENTENCE,cache)
+    here=os.path.dirname(os.path.abspath(__file__))
+    times=[]
+    for i in range(runs):
+        start=time.time()
+        subprocess.check_call([sys.executable,'-c',prelude+code],cwd=here)
+        times.append(time.time()-start)
+    times.sort()
+    return times[len(times)//2]
+
+if __name__=='__main__':
+    runs=int(sys.argv[1]) if len(sys.argv)>1 else 5
+    cache=tempfile.mkdtemp()
+    # fill the cache, so the cached case really is a warm start
+    sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+    import cky_grammar
+    cky_grammar.loadGrammar(GRAMMAR,cache)
+    for name,code in CASES:
+        print("%8.1f ms  %s"%(1000*timeCase(code,cache,runs),name))
@@ -0,0 +1,64 @@
+'''Benchmark CKY.parse with and without tracing
+
+Three ways of parsing the same sentences are timed:
+  untraced       parse(tokens), which runs no logging code at all
+  traced, quiet  the tracing methods bound but printing nothing, which
+                 is what every parse used to pay for
+  traced         parse(tokens,True), printing to os.devnull
+
+Usage: python bench_trace.py [runs]
+'''
+import contextlib,os,sys,time
+
+from cky_5 import CKY, Chart
+from cky_grammar import readGrammar
+
+GRAMMAR='''
+S -> NP VP
+NP -> Det Nom | Nom | NP PP
+Det -> NP "'s"
+Nom -> N SRel | N
+VP -> Vi | Vt NP | VP PP
+PP -> Prep NP
+SRel -> Relpro VP
+Det -> 'a' | 'the'
+N -> 'fish' | 'frogs' | 'soup' | 'children' | 'books'
+Prep -> 'in' | 'for'
+Vt -> 'saw' | 'ate' | 'read'
+Vi -> 'fish' | 'swim'
+Relpro -> 'that'
+'''
+
+SENTENCES=[s.split() for s in (
+    "the children ate the soup",
+    "the children ate the soup in the books for the frogs",
+    "frogs that swim saw the children's books in the soup for the fish",
+    "the children read books for the frogs in the soup for the fish in the books for the children",
+    )]
+
+class QuietTracing(Chart):
+    '''Binds the tracing methods for verbose parses, but never prints'''
+    verbose=property(lambda self:False,lambda self,value:None)
+
+def timeParses(chart,verbose,runs):
+    '''Best wall time in seconds of parsing all of SENTENCES'''
+    best=None
+    for i in range(runs):
+        start=time.time()
+        for tokens in SENTENCES:
+            chart.parse(tokens,verbose)
+        elapsed=time.time()-start
+        if best is None or elapsed<best:
+            best=elapsed
+    return best
+
+if __name__=='__main__':
+    runs=int(sys.argv[1]) if len(sys.argv)>1 else 20
+    grammar=readGrammar(GRAMMAR)
+    untraced=timeParses(CKY(grammar),False,runs)
+    quiet=timeParses(QuietTracing(grammar),True,runs)
+    with open(os.devnull,'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            traced=timeParses(CKY(grammar),True,runs)
+    for name,t in (("untraced",untraced),("traced, quiet",quiet),("traced",traced)):
+        print("%8.2f ms  %5.2fx  %s"%(1000*t,t/untraced,name))
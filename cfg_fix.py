@@ -3,15 +3,32 @@
 import re,sys
 import nltk
 from nltk.grammar import _ARROW_RE, _PROBABILITY_RE, _DISJUNCTION_RE, Production
-from nltk.draw import CFGEditor
-from nltk import Tree
+from nltk.tree import Tree
 ARROW = u'\u2192'
 TOKEN = u'([\\w ]|\\\\((x[0-9a-f][0-9a-f])|(u[0-9a-f][0-9a-f][0-9a-f][0-9a-f])))+'
-CFGEditor.ARROW = ARROW
-CFGEditor._TOKEN_RE=re.compile(u"->|u?'"+TOKEN+u"'|u?\""+TOKEN+u"\"|\\w+|("+ARROW+u")")
-CFGEditor._PRODUCTION_RE=re.compile(u"(^\s*\w+\s*)" +
-                  u"(->|("+ARROW+"))\s*" +
-                  u"((u?'"+TOKEN+"'|u?\""+TOKEN+"\"|''|\"\"|\w+|\|)\s*)*$")
+
+# nltk.draw pulls in Tkinter, so CFGEditor is only imported and fixed
+#  when someone asks for it, as cfg_fix.CFGEditor or fix_cfg_editor()
+_CFGEditor = None
+
+def fix_cfg_editor():
+    '''Import nltk.draw.CFGEditor, fix its regexps, and return it'''
+    global _CFGEditor
+    if _CFGEditor is None:
+        from nltk.draw import CFGEditor
+        CFGEditor.ARROW = ARROW
+        CFGEditor._TOKEN_RE=re.compile(u"->|u?'"+TOKEN+u"'|u?\""+TOKEN+u"\"|\\w+|("+ARROW+u")")
+        CFGEditor._PRODUCTION_RE=re.compile(u"(^\s*\w+\s*)" +
+                          u"(->|("+ARROW+"))\s*" +
+                          u"((u?'"+TOKEN+"'|u?\""+TOKEN+"\"|''|\"\"|\w+|\|)\s*)*$")
+        _CFGEditor = CFGEditor
+    return _CFGEditor
+
+def __getattr__(name):
+    if name == 'CFGEditor':
+        return fix_cfg_editor()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 nltk.grammar._TERMINAL_RE = re.compile(u'( u?"[^"]+" | u?\'[^\']+\' ) \s*', re.VERBOSE)
 nltk.grammar._ARROR_RE = re.compile(u'\s* (->|'+ARROW+') \s*', re.VERBOSE)
 
@@ -1,12 +1,20 @@
-import sys,re
-import nltk
-from collections import defaultdict
-import cfg_fix
-from cfg_fix import parse_grammar, CFG
+import sys,re,time
+from types import MappingProxyType
+# NLTK is slow to import, so cfg_fix and nltk are only imported when they
+#  are needed: to compile a grammar given as an NLTK CFG, or to build trees.
+#  A CompiledGrammar (say from cky_grammar.loadGrammar) parses without them.
+from cky_grammar import CompiledGrammar
 from pprint import pprint
 # The printing and tracing functionality is in a separate file in order
 #  to make this file easier to read
 from cky_print import CKY_pprint, CKY_log, Cell__str__, Cell_str, Cell_log
+from cky_print import CKY_tracedMaybeBuild, CKY_tracedBuild, Cell_logAdded
+from cky_bitset import CKY_recognise
+from cky_tensor import CKY_tensorParse
+from cky_forest import CKY_countParses, CKY_trees, unrankTree
+from cky_viterbi import CKY_viterbiParse
+from cky_stats import ParseStats
+from cky_cache import CKY_cachedParse
 
 class CKY:
     """An implementation of the Cocke-Kasami-Younger (bottom-up) CFG recogniser.
@@ -14,9 +22,15 @@ class CKY:
     Goes beyond strict CKY's insistance on Chomsky Normal Form.
     It allows arbitrary unary productions, not just NT->T
     ones, that is X -> Y with either Y -> A B or Y -> Z .
-    It also allows mixed binary productions, that is NT -> NT T or -> T NT"""
+    It also allows mixed binary productions, that is NT -> NT T or -> T NT
 
-    def __init__(self,grammar):
+    A CKY holds the compiled grammar, and each sentence is parsed into a
+    Chart of its own (see chartParse), so one CKY can serve many threads.
+    Those Charts can share the Cells of spans of words they have in common
+    through a cky_cache.SpanCache, and what whole sentences came to can be
+    kept in a cky_cache.ResultCache (see cachedParse)."""
+
+    def __init__(self,grammar,spans=None,results=None):
         '''Create an extended CKY processor for a particular grammar
 
         Grammar is an NLTK CFG
@@ -27,11 +41,26 @@ class CKY:
         an nltk.grammar.Nonterminal, that is, the two thinegs we find in
         nltk.grammar.Production)
 
-        :type grammar: nltk.grammar.CFG, as fixed by cfg_fix
+        It can also be a grammar which has already been compiled, say by
+        another CKY, in which case self.grammar is None.
+
+        :type grammar: nltk.grammar.CFG, as fixed by cfg_fix, or CompiledGrammar
         :param grammar: A context-free grammar
+        :type spans: cky_cache.SpanCache
+        :param spans: where to look for, and keep, the Cells of spans, or None
+        :type results: cky_cache.ResultCache
+        :param results: where cachedParse looks for, and keeps, its results, or None
         :return: none'''
 
-        self.verbose=False
+        self.spans=spans
+        self.results=results
+        if isinstance(grammar,CompiledGrammar):
+            self.grammar=None
+            self.compiled=grammar
+            self.unary=grammar.unary
+            self.binary=grammar.binary
+            return
+        from cfg_fix import CFG
         assert(isinstance(grammar,CFG))
         self.grammar=grammar
         # split and index the grammar
@@ -43,70 +72,292 @@ class CKY:
             production - Each production maps a single symbol on the "left-hand side"(non-terminal) to a sequence of symbols on the "right-hand side"(terminals or non-terminal)
         
         Since it is a bottom-up approach, the rhs of the productions are made keys of the dictionary and lhs are the values. 
-        This function segregates productions into unary and binary rules by checking the rhs length and returning them.
-
-        returns: Two dictionaries those have unary and binary grammar rules.
-        '''
-        self.unary=defaultdict(list)
-        self.binary=defaultdict(list)
-        for production in productions:
-            rhs=production.rhs()
-            lhs=production.lhs()
-            assert(len(rhs)>0 and len(rhs)<=2) # Cross-checking to CNF rule that states only 1 or 2 child(ren) are allowed 
-            if len(rhs)==1:
-                self.unary[rhs[0]].append(lhs)
-            else:
-                self.binary[rhs].append(lhs)
+        The productions are compiled into a CompiledGrammar, which interns every symbol to a small integer id,
+        and the chart runs on those ids. Unary rules are keyed by the id of the child, binary rules by the
+        two child ids packed into one int (see CompiledGrammar.pack).
 
-    def parse(self,tokens,verbose=False):
+        returns: none, but sets self.compiled and its two rule dictionaries self.unary and self.binary.
+        '''
+        self.compiled=CompiledGrammar(productions,self.grammar.start())
+        self.unary=self.compiled.unary
+        self.binary=self.compiled.binary
+
+    def symbolStr(self,i):
+        '''Return the printed form of the symbol with id i'''
+        return self.compiled.name(i)
+
+    def parse(self,tokens,verbose=False,beam=None,threshold=None,merit=None,stats=None):
+        '''Parse tokens into a new Chart, and keep that as this CKY's current chart
+
+        Takes the same arguments as, and returns what, Chart.parse does.  Afterwards
+        the chart's attributes (words, n, stats, ...) and methods (firstTree, trees,
+        countParses, pprint, ...) can be used as if they were this CKY's own.
+        That makes this CKY good for one parse at a time only: concurrent callers
+        should use chartParse and keep hold of their own Charts.
+        '''
+        self.lastChart=Chart(self.compiled,self.spans)
+        return self.lastChart.parse(tokens,verbose,beam,threshold,merit,stats)
+
+    def chartParse(self,tokens,verbose=False,beam=None,threshold=None,merit=None,stats=None):
+        '''Parse tokens into a new Chart, and return that
+
+        Nothing is kept in this CKY, which only holds the compiled grammar, and that is
+        never changed by parsing, so any number of threads can call this at once.
+        The result parse would have given is in the Chart's result.
+
+        :rtype: Chart'''
+        chart=Chart(self.compiled,self.spans)
+        chart.parse(tokens,verbose,beam,threshold,merit,stats)
+        return chart
+
+    def clear(self):
+        '''Drop the current chart, so it can be garbage collected'''
+        self.lastChart=None
+
+    def __getattr__(self,name):
+        # Only called for names a CKY doesn't have itself: look for them in
+        #  the current chart, so that the per-parse attributes and methods
+        #  which used to be a CKY's are still there after parse
+        if name.startswith('__') or name=='lastChart':
+            raise AttributeError(name)
+        chart=self.__dict__.get('lastChart')
+        if chart is None:
+            raise AttributeError("%r has no %r, and no current chart"%(type(self).__name__,name))
+        return getattr(chart,name)
+
+def __getattr__(name):
+    '''The names this module used to import from cfg_fix and nltk at load time,
+    now imported the first time they are asked for'''
+    if name in ('parse_grammar','CFG'):
+        import cfg_fix
+        return getattr(cfg_fix,name)
+    if name in ('cfg_fix','nltk'):
+        import importlib
+        return importlib.import_module(name)
+    raise AttributeError("module %r has no attribute %r"%(__name__,name))
+
+# helper methods from cky_bitset
+CKY.recognise=CKY_recognise
+# and from cky_tensor
+CKY.tensorParse=CKY_tensorParse
+# and from cky_viterbi
+CKY.viterbiParse=CKY_viterbiParse
+# and from cky_cache
+CKY.cachedParse=CKY_cachedParse
+
+class Chart:
+    '''The chart for one sentence, and what can be found from it
+
+    A Chart holds all the state of a parse, and shares nothing but the
+    CompiledGrammar, which parsing only ever reads, with other Charts.
+    So different threads can parse at once, each into Charts of its own,
+    over one grammar (see CKY.chartParse).'''
+
+    def __init__(self,compiled,spans=None):
+        '''
+        :type compiled: cky_grammar.CompiledGrammar
+        :param compiled: the grammar to parse with
+        :type spans: cky_cache.SpanCache
+        :param spans: where to look for the Cells of spans before building them,
+          and keep them afterwards, except in verbose parses; or None'''
+        self.compiled=compiled
+        self.spans=spans
+        self.spanKey=None
+        self.verbose=False
+        self.words=None
+        self.n=None
+        self.chart=None
+        self.result=None
+        self.stats=None
+        self.predicted=None
+
+    def symbolStr(self,i):
+        '''Return the printed form of the symbol with id i'''
+        return self.compiled.name(i)
+
+    def parse(self,tokens,verbose=False,beam=None,threshold=None,merit=None,stats=None):
         '''replace/expand this docstring. Your docs need NOT
         say anything more about the verbose option.
 
-        Initialise a n * n+1 matrix to create a upper traingular matrix (or a parse traingle/chart) from the sentence,
+        Initialise the chart, a flat list with one Cell for each span of the sentence (see cell),
         then run the CKY algorithm over it
 
-        :type tokens:
-        :param tokens:
+        A Chart can be parsed into again, but only one parse can be going on in it at a time.
+        More words can be added to the end of the sentence afterwards, see addToken.
+
+        The engine itself never logs: with verbose, tracing versions of maybeBuild, build and
+        Cell are bound for this parse (see TracedCell), so without it no logging code runs at all.
+
+        With beam and/or threshold, every Cell is pruned as soon as it is complete (see Cell.prune),
+        so long sentences take a predictable time at the cost of maybe missing some parses.
+        The number of labels pruned is left in self.pruned.
+
+        What the parse did is counted and timed in a ParseStats, self.stats, which trees built
+        from the chart afterwards add their time to. Passing the same ParseStats to several parses
+        totals them, though not from more than one thread at a time.
+
+        :type tokens: list(str)
+        :param tokens: the words of the sentence
         :type verbose: bool
         :param verbose: show debugging output if True, defaults to False
-        :rtype: 
-        :return:
+        :type beam: int
+        :param beam: keep at most this many non-terminal labels per Cell
+        :type threshold: float
+        :param threshold: drop labels whose merit is more than this below the best in their Cell
+        :type merit: function
+        :param merit: figure of merit for a Label, higher is better, defaults to Label.score
+        :type stats: ParseStats
+        :param stats: add this parse's counts and timings to these, defaults to new ones
+        :rtype: int or bool
+        :return: the number of labels in the top cell, or False if there are none
 
         '''
-        self.verbose=verbose
-        self.words = tokens
+        self.begin(verbose,beam,threshold,merit,stats)
+        stats=self.stats
+        self.words = list(tokens)
         self.n = len(self.words)+1
-        self.matrix = []
-        # We index by row, then column
-        #  So Y below is 1,2 and Z is 0,3
+        # The upper triangle of the matrix, by row (start) and
+        #  column (end), so Y below is 1,2 and Z is 0,3
         #    1   2   3  ...
         # 0  .   .   Z
         # 1      Y   .
         # 2          .
         # ...
-        for r in range(self.n-1):
-             # rows
-             row=[]
-             for c in range(self.n):
-                 # columns
-                 if c>r:
-                     # This is one we care about, add a cell
-                     row.append(Cell(r,c,self))
-                 else:
-                     # just a filler
-                     row.append(None)
-             self.matrix.append(row)
+        #  stored column by column, so Z is chart[3*2//2+0]
+        # Most spans of a long sentence never get a label, so they all
+        #  share EMPTY until something is built there
+        self.chart=[EMPTY]*(self.n*(self.n-1)//2)
+        stats.words+=self.n-1
+        # every (start, mid, end) with start<mid<end<=n-1
+        stats.splits+=self.n*(self.n-1)*(self.n-2)//6
+        start=time.perf_counter()
         self.unaryFill()
+        filled=time.perf_counter()
         self.binaryScan()
+        stats.fillTime+=filled-start
+        stats.scanTime+=time.perf_counter()-filled
         # Replace the line below for Q6
         #######       Done with building the CKY parse matrix        ########
         totalParsersNumber = 0
-        totalParsersNumber = len(self.matrix[0][self.n-1].labels())
+        totalParsersNumber = len(self.cell(0,self.n-1).labels())
         # print('------------------'+totalParsersNumber+'-----------------')
         if totalParsersNumber != 0:
-            return totalParsersNumber
+            self.result=totalParsersNumber
+        else:
+            self.result=False
+        return self.result
+
+    def begin(self,verbose=False,beam=None,threshold=None,merit=None,stats=None):
+        '''Start a parse of a sentence with no words in it yet, to be added one at a time
+        with addToken, with the same options as parse'''
+        self.verbose=verbose
+        if verbose:
+            self.maybeBuild=self.tracedMaybeBuild
+            self.build=self.tracedBuild
+            self.cellType=TracedCell
+        else:
+            for name in ('maybeBuild','build','cellType'):
+                self.__dict__.pop(name,None)
+        if beam is None and threshold is None:
+            self.prune=None
         else:
+            self.prune=(beam,threshold,merit or Label.score)
+        self.pruned=0
+        # what the span cache is keyed by, besides the words
+        self.spanKey=None
+        if self.spans is not None and not verbose:
+            self.spanKey=(self.compiled.fingerprint,self.prune)
+        # where in chart the Cells came from the span cache
+        self.reused=set()
+        if stats is None:
+            stats=ParseStats()
+        self.stats=stats
+        stats.sentences+=1
+        self.words=[]
+        self.n=1
+        self.chart=[]
+        self.result=False
+        # what each position can start with, worked out by isPrefix
+        self.predicted=None
+
+    def addToken(self,token):
+        '''Add a word to the end of the sentence, and fill in the spans that end with it
+
+        The chart is stored column by column (see parse), so the new column just goes on the
+        end, and nothing already in the chart changes: the Cells end up just as parse would
+        have made them for the whole sentence so far.
+
+        :type token: str
+        :param token: the next word
+        :rtype: int or bool
+        :return: what parse would return for the sentence so far
+        '''
+        stats=self.stats
+        self.words.append(token)
+        end=self.n
+        self.n+=1
+        self.chart.extend([EMPTY]*end)
+        stats.words+=1
+        stats.cells+=1
+        # every (start, mid, end) with start<mid<end
+        stats.splits+=end*(end-1)//2
+        start=time.perf_counter()
+        peak=self.fillWord(end-1)
+        filled=time.perf_counter()
+        peak=max(peak,self.fillColumn(end))
+        stats.fillTime+=filled-start
+        stats.scanTime+=time.perf_counter()-filled
+        if peak>stats.peakLabels:
+            stats.peakLabels=peak
+        self.result=len(self.cell(0,end)._labels) or False
+        return self.result
+
+    def isPrefix(self):
+        '''Return True if the words so far are the start of some sentence of the grammar
+
+        (Or the whole of one.) Works out, for each position i from the left, the set
+        of symbols X for which the start symbol derives the first i words followed by
+        X and then anything: at 0 those are the start symbol and its left corners (see
+        CompiledGrammar.leftCorners), and at i, the right children (and their left corners)
+        of every rule A -> B C with A predicted at some j and a B in the Cell for j..i.
+        The words so far are a prefix if the last of them is predicted, or is the left
+        corner of something predicted, at its position. The sets are kept, so asking
+        again after addToken only works out the new ones.
+        '''
+        words=len(self.words)
+        if words==0:
+            return True
+        g=self.compiled
+        corners=g.leftCorners
+        predicted=self.predicted
+        if predicted is None:
+            predicted=self.predicted=[corners[g.start]]
+        byLeft=g.binaryByLeft
+        while len(predicted)<words:
+            end=len(predicted)
+            here=set()
+            for start in range(end):
+                before=predicted[start]
+                if not before:
+                    continue
+                for label in self.cell(start,end)._labels:
+                    for right,parents in byLeft.get(label._symbol,{}).items():
+                        if right not in here and not before.isdisjoint(parents):
+                            here.add(right)
+                            here.update(corners.get(right,()))
+            predicted.append(frozenset(here))
+        last=predicted[words-1]
+        i=g.symbolId(self.words[-1])
+        if i is None:
             return False
+        if i in last or not last.isdisjoint(g.unary.get(i,())):
+            return True
+        return any(not last.isdisjoint(parents) for parents in byLeft.get(i,{}).values())
+
+    def cell(self,start,end):
+        '''Return the Cell for the words from start up to (not including) end'''
+        return self.chart[end*(end-1)//2+start]
+
     def unaryFill(self):
         '''
         args: none
@@ -116,11 +367,32 @@ class CKY:
 
         returns: none
         '''
+        stats=self.stats
+        stats.cells+=self.n-1
+        peak=0
         for r in range(self.n-1):
-            cell=self.matrix[r][r+1]
-            word=self.words[r]
-            cell.addLabel(Label(word))
-            # cell.unaryUpdate(word)
+            peak=max(peak,self.fillWord(r))
+        if peak>stats.peakLabels:
+            stats.peakLabels=peak
+
+    def fillWord(self,r):
+        '''Fill the Cell for word r, returning how many labels it got (before any pruning)'''
+        cell=self.chart[(r+1)*r//2+r]=self.cellType(r,r+1,self)
+        word=self.words[r]
+        i=self.compiled.symbolId(word)
+        if i is None:
+            # Not in the grammar, so nothing can be built over it
+            if self.verbose:
+                cell.log("%s (unknown)",word)
+            return 0
+        cell.addLabel(Label(i))
+        # cell.unaryUpdate(word)
+        labels=len(cell._labels)
+        if self.compiled.unaryCycles:
+            cell.untangle()
+        if self.prune:
+            self.pruned+=cell.prune(*self.prune)
+        return labels
 
     def binaryScan(self):
         '''(The heart of the implementation.)
@@ -135,11 +407,84 @@ for each possible choice of (start, mid, end) positions to try to
 build something at those positions.
 
         '''
+        chart=self.chart
+        cached=self.spanKey is not None
+        cycles=self.compiled.unaryCycles
+        peak=0
         for span in range(2, self.n):
             for start in range(self.n-span):
                 end = start + span
+                if cached and self.reuseSpan(start,end):
+                    continue
                 for mid in range(start+1, end):
                     self.maybeBuild(start, mid, end)
+                cell=chart[end*(end-1)//2+start]
+                if len(cell._labels)>peak:
+                    peak=len(cell._labels)
+                if cycles and cell._labels:
+                    cell.untangle()
+                if self.prune:
+                    self.pruned+=cell.prune(*self.prune)
+                if cached:
+                    self.keepSpan(start,end)
+        if peak>self.stats.peakLabels:
+            self.stats.peakLabels=peak
+
+    def fillColumn(self,end):
+        '''Fill the Cells for the spans of two or more words which end at end, shortest
+        first, once all the spans ending before it are done, returning the most labels
+        any of them got (before any pruning)'''
+        chart=self.chart
+        cached=self.spanKey is not None
+        cycles=self.compiled.unaryCycles
+        peak=0
+        for start in range(end-2,-1,-1):
+            if cached and self.reuseSpan(start,end):
+                continue
+            for mid in range(start+1, end):
+                self.maybeBuild(start, mid, end)
+            cell=chart[end*(end-1)//2+start]
+            if len(cell._labels)>peak:
+                peak=len(cell._labels)
+            if cycles and cell._labels:
+                cell.untangle()
+            if self.prune:
+                self.pruned+=cell.prune(*self.prune)
+            if cached:
+                self.keepSpan(start,end)
+        return peak
+
+    def reuseSpan(self,start,end):
+        '''Take the Cell for the words from start to end from the span cache, if it
+        has one for them, returning whether it had'''
+        words=end-start
+        if words<self.spans.minWords:
+            return False
+        k=end*(end-1)//2+start
+        # A span was kept along with the two one word shorter ones inside it,
+        #  start..end-1 and start+1..end, so if either of those wasn't there,
+        #  it won't be either
+        if words>self.spans.minWords and not (k-end+1 in self.reused and k+1 in self.reused):
+            return False
+        entry=self.spans.get(self.spanKey+(tuple(self.words[start:end]),))
+        if entry is None:
+            return False
+        labels,index=entry
+        self.reused.add(k)
+        if labels:
+            cell=self.chart[k]=self.cellType(start,end,self)
+            cell._labels=labels
+            cell._index=index
+            self.stats.cells+=1
+        # none of its splits need trying
+        self.stats.splits-=end-start-1
+        return True
+
+    def keepSpan(self,start,end):
+        '''Put the Cell for the words from start to end, which is complete, in the span cache'''
+        if end-start>=self.spans.minWords:
+            cell=self.chart[end*(end-1)//2+start]
+            self.spans.put(self.spanKey+(tuple(self.words[start:end]),),cell._labels,cell._index)
 
     def maybeBuild(self, start, mid, end):
         '''
@@ -148,135 +493,389 @@ build something at those positions.
         returns the value of the rhs key from the binary dictionary. 
         Then it is passed back to the unaryUpdate function where the found elements are stacked above the current co-occurring adjacent terminals or non-terminals in the matrix.
 
+        Only labels which can be a left (resp. right) child of some binary rule are looked at, and the
+        outer loop is over whichever of the two child cells has fewer of them, each label picking out its
+        row of the two-level binary index (CompiledGrammar.binaryByLeft/binaryByRight). When that is the
+        right cell, the matches are built afterwards in (left label, right label) order, so the Cell ends
+        up the same as with a plain scan of all pairs.
+
         '''
-        self.log("%s--%s--%s:",start, mid, end)
-        cell=self.matrix[start][end]
-        for s1 in self.matrix[start][mid].labels():
-            for s2 in self.matrix[mid][end].labels():
-                if (s1.symbol(),s2.symbol()) in self.binary:
-                    for s in self.binary[(s1.symbol(),s2.symbol())]:
-                        # print('----------reached here-----------')
-                        self.log("%s -> %s %s", s.symbol(), s1.symbol(), s2.symbol(), indent=1)
-                        s_label = Label(s, s1, s2)
-                        cell.addLabel(s_label, 1)
-                        # cell.unaryUpdate(s,1)
-        
+        chart=self.chart
+        leftLabels=chart[mid*(mid-1)//2+start]._labels
+        rightLabels=chart[end*(end-1)//2+mid]._labels
+        if not (leftLabels and rightLabels):
+            return
+        g=self.compiled
+        canLeft=g.canLeft
+        lefts=[l for l in leftLabels if l._symbol in canLeft]
+        if not lefts:
+            return
+        canRight=g.canRight
+        rights=[r for r in rightLabels if r._symbol in canRight]
+        if not rights:
+            return
+        k=end*(end-1)//2+start
+        cell=chart[k]
+        if cell is EMPTY:
+            cell=chart[k]=self.cellType(start,end,self)
+            self.stats.cells+=1
+        self.stats.pairs+=len(lefts)*len(rights)
+        if len(lefts)<=len(rights):
+            byLeft=g.scoredByLeft
+            for s1 in lefts:
+                table=byLeft[s1._symbol]
+                for s2 in rights:
+                    parents=table.get(s2._symbol)
+                    if parents is not None:
+                        self.build(cell,parents,s1,s2)
+        else:
+            byRight=g.scoredByRight
+            hits=[]
+            for j,s2 in enumerate(rights):
+                table=byRight[s2._symbol]
+                for i,s1 in enumerate(lefts):
+                    parents=table.get(s1._symbol)
+                    if parents is not None:
+                        hits.append((i,j,parents))
+            hits.sort()
+            for i,j,parents in hits:
+                self.build(cell,parents,lefts[i],rights[j])
+
+    def build(self,cell,rules,s1,s2):
+        '''Add a label to cell for each (parent, log probability) in rules, built over s1 and s2'''
+        self.stats.binaryHits+=len(rules)
+        score=s1._score+s2._score
+        for s,logProb in rules:
+            s_label = Label(s, s1, s2, score+logProb)
+            cell.addLabel(s_label, 1)
    
     def create_trees(self,node,tree):
         '''
         A plain binary tree pre-order traversal seems to be a better fit for building up trees
         from the matrix. The traversal moves along the parent node first, left nodes then and right nodes later. 
-        Before inserting a parent node, it prefixes with '(' and after adding a parent node it adds a ')'. As recursions are
-        timely placed, parents are not just enclosed by brackets as it would seem.
+        Before inserting a parent node, it prefixes with '(' and after adding a parent node it adds a ')'.
+        The traversal keeps its own stack, with None standing for a ')' still to come, rather than
+        recursing, so there is no limit on the depth of the tree.
 
-        args: node - 
+        args: node - the label at the root
+              tree - a list to append the bracketed form of the tree to, one token at a time
 
+        returns: tree
         '''
-        if node.is_parent:
-            tree.append("(")
-        symbol_str=""
-        if type(node.symbol()) is not str:
-            symbol_str=node.symbol().__str__()
-        else:
-            symbol_str=node.symbol()
-        tree.append(symbol_str)
-        if  node.return_lhs():
-            self.create_trees(node.return_lhs(),tree)
-        if node.return_rhs():
-            self.create_trees(node.return_rhs(),tree)
-        if node.return_is_parent():
-            tree.append(")")
+        agenda=[node]
+        while agenda:
+            node=agenda.pop()
+            if node is None:
+                tree.append(")")
+                continue
+            if node.is_parent:
+                tree.append("(")
+                agenda.append(None)
+            tree.append(self.symbolStr(node.symbol()))
+            # right child pushed first, so the left one comes out first
+            if node.return_rhs():
+                agenda.append(node.return_rhs())
+            if node.return_lhs():
+                agenda.append(node.return_lhs())
         return tree
     
     def firstTree(self):
         ''' 
-        A helper function which makes call to creat_trees( which is a recursive implementation of tree traversal)
-        that returns the grammar formalism.
-        args: None required. self (its own) object has matrix to work on.abs
-        returns: an nltk tree object that represents the first parser.
-        '''
-        label = self.matrix[0][self.n-1]._labels[0]
-        start_symbol = self.grammar.start()
-        tree = self.create_trees(label,[])
-        print(tree)
-        nltk_tree = nltk.tree.Tree.fromstring(' '.join(tree))
+        Builds the first tree in the chart: the first non-terminal label in the top cell, following
+        the first derivation of each label below it. The nltk Tree is built directly by an iterative
+        walk (see cky_forest.unrankTree), with no bracketed string to print and read back in.
+        args: None required. self (its own) object has the chart to work on.
+        returns: an nltk tree object that represents the first parser, or None if there is none.
+        '''
+        start=time.perf_counter()
+        for label in self.cell(0,self.n-1)._labels:
+            if label.is_parent:
+                break
+        else:
+            return None
+        nltk_tree = unrankTree(self,label,0,None)
+        self.stats.treeTime+=time.perf_counter()-start
         # nltk_tree.draw()  # Uncomment if you wanna draw the given bracketed grammar
         return nltk_tree
-    
 
 # helper methods from cky_print
-CKY.pprint=CKY_pprint
-CKY.log=CKY_log
+Chart.pprint=CKY_pprint
+Chart.log=CKY_log
+Chart.tracedMaybeBuild=CKY_tracedMaybeBuild
+Chart.tracedBuild=CKY_tracedBuild
+# and from cky_forest
+Chart.countParses=CKY_countParses
+Chart.trees=CKY_trees
+
+# What an empty Cell holds, shared until it gets its first label
+NOLABELS=()
+NOINDEX=MappingProxyType({})
 
 class Cell:
-    '''A cell in a CKY matrix'''
+    '''A cell in a CKY matrix
+
+    The labels are kept in the order they were added, in _labels,
+    and also indexed by symbol id, in _index, so membership tests
+    and lookups don't have to scan the list.  Most of the cells of a
+    long sentence stay empty, so these are only allocated when the
+    first label comes along, and there are __slots__ instead of a
+    __dict__.  Spans with nothing in them at all share the one Cell
+    EMPTY, which is never added to.'''
+    __slots__=('_row','_column','matrix','_labels','_index')
+
     def __init__(self,row,column,matrix):
         self._row=row
         self._column=column
         self.matrix=matrix
-        self._labels=[]
-
-    def addLabel(self,label,depth=0,recursive=False):
-        if label.symbol() not in [l.symbol() for l in self.labels()]:
+        self._labels=NOLABELS
+        self._index=NOINDEX
+
+    def addLabel(self,label,depth=0):
+        '''Add label to the Cell, or if there is already a label for its
+        symbol, add label's children to that one as another derivation'''
+        symbol=label.symbol()
+        existing=self._index.get(symbol)
+        if existing is None:
+            if not self._labels:
+                self._labels=[]
+                self._index={}
+            self._index[symbol]=label
             self._labels.append(label)
-            self.unaryUpdate(label,depth,recursive)
+            self.unaryUpdate(label,depth)
+        elif label.is_parent:
+            if existing.addDerivation(label._lhs,label._rhs,label._score):
+                self.rescore(symbol)
 
     def labels(self):
         return self._labels
 
-    def unaryUpdate(self,label,depth=0,recursive=False):
-        '''
-        args: terminal (word from the sentence, if depth is 0) / non-terminals if depth is > 0
+    def label(self,symbol):
+        '''Return the label for the symbol with id symbol, or None'''
+        return self._index.get(symbol)
 
-        Logs the terminal/non-terminal in the Cell. 
-        Then checks for the terminal or non-terminal in the unary dictionary, 
-        where terminal or non-terminal (patterns of interest) will be stored as the values with keys as the parent of the rule 
-        (lhs in a production )
+    def __contains__(self,symbol):
+        return symbol in self._index
+
+    def unaryUpdate(self,label,depth=0):
+        '''
+        args: a label just added to the Cell, for a terminal (word from the sentence, if depth is 0) / non-terminal if depth is > 0
+
+        Adds everything that can be built above it by unary rules, in one pass over
+        the closure precomputed by the CompiledGrammar (see CompiledGrammar.unaryClosure),
+        each ancestor getting a label whose child is the label for the symbol below it in the chain.
+        An ancestor already in the Cell gets another derivation instead, even one through a
+        unary cycle (see CompiledGrammar.unaryCycles), which untangle sorts out once the Cell
+        is complete. Ancestors of labels which were already in the Cell already have derivations
+        through them, so they are skipped.
         '''
         symbol = label.symbol()
-        if not recursive:
-            self.log(str(symbol),indent=depth)
-        if symbol in self.matrix.unary:
-            for parent in self.matrix.unary[symbol]:
-                self.matrix.log("%s -> %s",parent,symbol,indent=depth+1)
-                # self.addLabel(parent)
-                # self.unaryUpdate(parent,depth+1,True)
-                parent_label = Label(parent, label)
-                self.addLabel(parent_label,depth+1,True)
+        closure=self.matrix.compiled.unaryClosure[symbol]
+        if not closure:
+            return
+        self.matrix.stats.unaryClosures+=1
+        index=self._index
+        added=set([symbol])
+        improved=False
+        for parent,child,logProb in closure:
+            if child not in added:
+                continue
+            child_label=index[child]
+            parent_label=index.get(parent)
+            if parent_label is None:
+                parent_label = Label(parent, child_label, None, child_label._score+logProb)
+                index[parent]=parent_label
+                self._labels.append(parent_label)
+                added.add(parent)
+            elif parent_label.addDerivation(child_label,None,child_label._score+logProb):
+                improved=True
+        if improved:
+            self.rescore(symbol)
+
+    def rescore(self,symbol):
+        '''
+        args: the id of a symbol whose label's score has gone up
+
+        Passes the better score on to everything built over that label by unary rules in this Cell,
+        until nothing changes. Log probabilities are never above 0.0, so going round a unary cycle
+        never makes a score better, and this stops.
+        '''
+        closure=self.matrix.compiled.unaryClosure[symbol]
+        index=self._index
+        changed=True
+        while changed:
+            changed=False
+            for parent,child,logProb in closure:
+                parent_label=index.get(parent)
+                child_label=index.get(child)
+                if parent_label is None or child_label is None:
+                    continue
+                if child_label._score+logProb>parent_label._score:
+                    parent_label._score=child_label._score+logProb
+                    changed=True
+
+    def untangle(self):
+        '''
+        Cuts the unary cycles out of the forest of a complete Cell, when the grammar has them.
+
+        unaryUpdate records every derivation through a unary rule, so with X -> Y and Y -> X
+        the label for X can be built over the one for Y and the other way round. The trees
+        wanted are those with no symbol repeated in a chain of unary rules, whatever order the
+        rules came in: so each label keeps only its derivations whose chain down stays clear of
+        it, and where a child's own derivations would lead back to a symbol further up the chain,
+        the derivation goes through a copy of the child's label with just the derivations which
+        don't. These copies are not in the Cell, they are only there as children.
+        '''
+        cycles=self.matrix.compiled.unaryCycles
+        # every derivation in the Cell, before any are changed
+        derivations={}
+        tangled=False
+        for label in self._labels:
+            derivations[label._symbol]=label.derivations()
+            for lhs,rhs in derivations[label._symbol]:
+                if rhs is None and (label._symbol,lhs._symbol) in cycles:
+                    tangled=True
+        if not tangled:
+            return
+        # the symbols below each one in chains of unary derivations in the Cell
+        below={}
+        for symbol,derivs in derivations.items():
+            seen=set()
+            agenda=[symbol]
+            while agenda:
+                for lhs,rhs in derivations[agenda.pop()]:
+                    if rhs is None and lhs._symbol not in seen:
+                        seen.add(lhs._symbol)
+                        agenda.append(lhs._symbol)
+            below[symbol]=seen
+        logProb=self.matrix.compiled.logProb
+        copies={}
+
+        def clear(symbol,above):
+            # the label for symbol with only the derivations whose unary chains miss
+            #  the symbols in above (which includes symbol), or None if there are none
+            avoid=frozenset(above&below[symbol])-set([symbol])
+            key=(symbol,avoid)
+            if key in copies:
+                return copies[key]
+            label=self._index[symbol]
+            if not label.is_parent:
+                return label
+            kept=[]
+            for lhs,rhs in derivations[symbol]:
+                if rhs is None:
+                    if lhs._symbol in above:
+                        continue
+                    lhs=clear(lhs._symbol,above|set([lhs._symbol]))
+                    if lhs is None:
+                        continue
+                kept.append((lhs,rhs))
+            if avoid:
+                if not kept:
+                    copies[key]=None
+                    return None
+                score=max(l._score+logProb[(symbol,l._symbol)] if r is None else
+                          l._score+r._score+logProb[(symbol,l._symbol,r._symbol)]
+                          for l,r in kept)
+                label=Label(symbol,kept[0][0],kept[0][1],score)
+            else:
+                label._lhs,label._rhs=kept[0]
+            label._more=kept[1:] or None
+            copies[key]=label
+            return label
+
+        for label in self._labels:
+            if label.is_parent:
+                clear(label._symbol,set([label._symbol]))
+
+    def prune(self,beam,threshold,merit):
+        '''
+        args: beam - keep at most this many non-terminal labels, or None
+              threshold - drop labels whose merit is more than this below the best, or None
+              merit - a function from Label to figure of merit, higher is better
+
+        Prunes the non-terminal labels of a complete Cell, keeping the survivors in their order.
+        Labels for words are always kept. A pruned label is no longer used to build anything
+        in bigger Cells, but labels already built over it keep it as their child.
+
+        returns: the number of labels pruned
+        '''
+        candidates=[l for l in self._labels if l.is_parent]
+        if not candidates:
+            return 0
+        scores=dict((id(l),merit(l)) for l in candidates)
+        keep=candidates
+        if threshold is not None:
+            floor=max(scores.values())-threshold
+            keep=[l for l in keep if scores[id(l)]>=floor]
+        if beam is not None and len(keep)>beam:
+            # sorted is stable, so ties go to the earlier label
+            keep=sorted(keep,key=lambda l:-scores[id(l)])[:beam]
+        pruned=len(candidates)-len(keep)
+        if pruned:
+            kept=set(id(l) for l in keep)
+            self._labels=[l for l in self._labels if not l.is_parent or id(l) in kept]
+            self._index=dict((l.symbol(),l) for l in self._labels)
+        return pruned
+
+EMPTY=Cell(None,None,None)
 
 # helper methods from cky_print
 Cell.__str__=Cell__str__
 Cell.str=Cell_str
 Cell.log=Cell_log
+Cell.logAdded=Cell_logAdded
+
+class TracedCell(Cell):
+    '''A Cell which logs each label added to it, and each label built over
+    that by unary rules, for parsing with verbose.'''
+    __slots__=()
+
+    def unaryUpdate(self,label,depth=0):
+        # addLabel has just appended label, and everything built over
+        #  it will be appended after it
+        first=len(self._labels)-1
+        Cell.unaryUpdate(self,label,depth)
+        self.logAdded(first,depth)
+
+Chart.cellType=Cell
 
 class Label:
     '''A label for a substring in a CKY chart Cell
 
-    Includes a terminal or non-terminal symbol, possibly other
-    information.  Add more to this docstring when you start using this
-    class'''
-    def __init__(self,symbol, lhs = None, rhs = None):
-        '''Create a label from a symbol and ...
-        :type symbol: a string (for terminals) or an nltk.grammar.Nonterminal
-        :param symbol: a terminal or non-terminal
-        :type lhs: a string (for terminals) or an nltk.grammar.Nonterminal
-        :param lhs: a terminal or non-terminal labelled as left hand child of the symbol variable
-        :type rhs: a string (for terminals) or an nltk.grammar.Nonterminal
-        :param rhs: a terminal or non-terminal labelled as left hand child of the symbol variable
+    Includes a terminal or non-terminal symbol and the child label(s)
+    it was built from, and a score, the log probability of the best
+    derivation of the label seen so far.  Scores are all 0.0 unless the
+    grammar is probabilistic.  The labels in a chart make up a packed parse
+    forest: there is one label per symbol per Cell, and every way of
+    building it is kept, the first in _lhs and _rhs and any others as
+    (lhs, rhs) pairs in _more (see derivations).
+
+    The children are the Label objects themselves rather than
+    (cell, symbol) indices, since a child can be pruned from its Cell
+    (see Cell.prune) and still be needed for the trees over it.'''
+    __slots__=('_symbol','_score','_lhs','_rhs','_more','is_parent')
+
+    def __init__(self,symbol, lhs = None, rhs = None, score = 0.0):
+        '''Create a label from a symbol and the label(s) it was built from
+        :type symbol: int
+        :param symbol: the id of a terminal or non-terminal in the CompiledGrammar
+        :type lhs: Label
+        :param lhs: the label of the left hand child of the symbol variable
+        :type rhs: Label
+        :param rhs: the label of the right hand child of the symbol variable
+        :type score: float
+        :param score: the log probability of this derivation
         '''
         self._symbol=symbol
+        self._score=score
         self._lhs=lhs
         self._rhs=rhs
+        self._more=None
         if(self._lhs or self._rhs):
             self.is_parent = True
         else:
             self.is_parent = False
 
-        # augment as appropriate, with comments
-
-    def __str__(self):
-        return str(self._symbol)
-
     def __eq__(self,other):
         '''How to test for equality -- other must be a label,
         and symbols have to be equal'''
@@ -303,4 +902,37 @@ class Label:
         returns boolean based on if the given symbol is a parent
         '''
         return self.is_parent
+
+    def addDerivation(self,lhs,rhs=None,score=0.0):
+        '''
+        records another way of building this label, from lhs (and rhs, for a binary rule),
+        with log probability score
+
+        returns True if that is better than the label's score so far
+        '''
+        if self._more is None:
+            self._more=[]
+        self._more.append((lhs,rhs))
+        if score>self._score:
+            self._score=score
+            return True
+        return False
+
+    def score(self):
+        '''
+        returns the log probability of the best derivation of this label seen so far
+        '''
+        return self._score
+
+    def derivations(self):
+        '''
+        returns a list of (lhs, rhs) pairs, one per way of building this label,
+        rhs being None for a unary rule. Empty for a terminal.
+        '''
+        if not self.is_parent:
+            return []
+        res=[(self._lhs,self._rhs)]
+        if self._more is not None:
+            res.extend(self._more)
+        return res
     # Add more methods as required, with docstring and comments
@@ -0,0 +1,73 @@
+'''Parse many sentences at once, on a pool of worker processes
+
+The grammar is compiled once, in the calling process, and each worker
+is started with the compiled tables, so none of them re-reads or
+re-indexes the grammar.  Results come back in input order, as they are
+ready.
+'''
+import multiprocessing
+from collections import deque
+from itertools import islice
+from cky_5 import CKY
+from cky_grammar import CompiledGrammar
+
+# The parser for this worker process, set up by initWorker
+_worker=None
+
+def initWorker(compiled,method):
+    '''Start a worker with a CKY over an already compiled grammar'''
+    global _worker
+    _worker=getattr(CKY(compiled),method)
+
+def parseChunk(chunk,**kwargs):
+    '''Parse a list of tokenised sentences in a worker started by initWorker,
+    passing kwargs on to its method'''
+    return [_worker(tokens,**kwargs) for tokens in chunk]
+
+def parse_many(grammar,sentences,workers=None,chunksize=16,method='parse'):
+    '''Parse sentences with a pool of worker processes
+
+    :type grammar: nltk.grammar.CFG, CompiledGrammar or CKY
+    :param grammar: the grammar, compiled here if it isn't already
+    :type sentences: iterable(list(str))
+    :param sentences: tokenised sentences, read as they are needed
+    :type workers: int
+    :param workers: how many processes, defaults to one per CPU, and
+      1 parses in this process without a pool
+    :type chunksize: int
+    :param chunksize: how many sentences to send a worker at a time
+    :type method: str
+    :param method: the CKY method to call on each sentence, e.g.
+      'parse', 'recognise' or 'viterbiParse'
+    :rtype: iterator
+    :return: what method returns for each sentence, in input order'''
+    if isinstance(grammar,CKY):
+        compiled=grammar.compiled
+    elif isinstance(grammar,CompiledGrammar):
+        compiled=grammar
+    else:
+        compiled=CKY(grammar).compiled
+    if workers is None:
+        workers=multiprocessing.cpu_count()
+    if workers<=1:
+        parse=getattr(CKY(compiled),method)
+        for tokens in sentences:
+            yield parse(tokens)
+        return
+    sentences=iter(sentences)
+    chunks=iter(lambda:list(islice(sentences,chunksize)),[])
+    # Pool.imap reads all its input up front, so keep a sliding window of
+    #  chunks in flight instead, with another read in as each one at the
+    #  head comes back: memory stays bounded for long streams of sentences,
+    #  and the pool never has to drain
+    window=workers*4
+    with multiprocessing.Pool(workers,initWorker,(compiled,method)) as pool:
+        pending=deque(pool.apply_async(parseChunk,(chunk,)) for chunk in islice(chunks,window))
+        while pending:
+            results=pending.popleft().get()
+            # before handing these back, so the workers stay busy while
+            #  the caller deals with them
+            for chunk in islice(chunks,1):
+                pending.append(pool.apply_async(parseChunk,(chunk,)))
+            for result in results:
+                yield result
@@ -0,0 +1,60 @@
+'''Augment CKY with a bit-parallel recogniser
+
+Each chart cell is a single Python int used as a bitset over the
+symbol ids of the CompiledGrammar, so no Cell or Label objects are
+built, and the binary and unary steps are word-level bit operations
+against the masks precomputed by CompiledGrammar.buildMasks.
+'''
+
+def CKY_recognise(self,tokens):
+    '''Decide whether tokens is a sentence of the grammar
+
+    Fills a chart of bitsets in the same order as binaryScan, but
+    keeps no labels or backpointers, so it is the thing to use for
+    yes/no grammaticality filtering.
+
+    :type tokens: list(str)
+    :param tokens: the words of the sentence
+    :rtype: bool
+    :return: True iff the start symbol spans all of tokens'''
+    g=self.compiled
+    n=len(tokens)
+    if n==0:
+        return False
+    unaryMask=g.unaryMask
+    leftMask=g.leftMask
+    rightMask=g.rightMask
+    binaryRight=g.binaryRight
+    # chart[start][end], for span start..end
+    chart=[[0]*(n+1) for r in range(n)]
+    for r in range(n):
+        i=g.symbolId(tokens[r])
+        if i is not None:
+            chart[r][r+1]=unaryMask[i]
+    for span in range(2,n+1):
+        for start in range(n-span+1):
+            end=start+span
+            row=chart[start]
+            built=0
+            for mid in range(start+1,end):
+                right=chart[mid][end]
+                if not right:
+                    continue
+                left=row[mid]&leftMask
+                while left:
+                    # peel off the lowest set bit
+                    low=left&-left
+                    left^=low
+                    l=low.bit_length()-1
+                    if right&rightMask[l]:
+                        for r,parents in binaryRight[l]:
+                            if (right>>r)&1:
+                                built|=parents
+            # unary closure of everything built
+            cell=0
+            while built:
+                low=built&-built
+                built^=low
+                cell|=unaryMask[low.bit_length()-1]
+            row[end]=cell
+    return bool((chart[0][n]>>g.start)&1)
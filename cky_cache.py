@@ -0,0 +1,241 @@
+'''Caches of parsing work, to share between sentences
+
+For a context-free grammar what ends up in a chart Cell depends only on
+the words it spans, so when many sentences share long stretches of
+words (boilerplate, templates, near-duplicates) most of their charts
+are the same.  A SpanCache keeps the Cells of the spans it has seen,
+keyed by the grammar's fingerprint, the pruning options and the words,
+and a Chart given one (see CKY(grammar,spans=...)) takes each Cell it
+can from there instead of building it:
+
+  spans=SpanCache(maxBytes=256*2**20)
+  parser=CKY(grammar,spans=spans)
+  for tokens in sentences:
+      parser.parse(tokens)
+  print(spans.metrics())
+
+The Labels in a cached Cell are shared, as they are never changed once
+their Cell is complete, and their children are the Labels of the
+smaller spans, so trees and counts come out just as without the cache.
+
+A ResultCache keeps what whole sentences came to, their parse counts
+and first trees, for traffic where the same sentences come up again and
+again, and can be saved to disk between runs; CKY(grammar,results=...)
+consults it in cachedParse.
+'''
+import sys,threading
+from collections import OrderedDict
+from cky_grammar import readAtomic,writeAtomic
+
+class SpanCache:
+    '''A least recently used cache of chart Cells, by the words they span
+
+    Only spans of at least minWords words are kept, shorter ones being
+    as quick to build as to look up, and never fewer than two, as the
+    Cells of single words are filled straight from the lexicon.  The size of an entry is estimated
+    as that of its key, its label list and index, and its own Labels
+    (not their children, which belong to smaller spans), and entries
+    are evicted, least recently used first, to keep the total under
+    maxBytes.  An evicted Cell's Labels stay alive as long as some
+    cached Cell, or a Chart, is built over them, so the real total can
+    be somewhat more.  It can be shared by any number of CKYs and
+    threads.
+
+    :type maxBytes: int
+    :param maxBytes: the most memory to use, roughly
+    :type minWords: int
+    :param minWords: the shortest span to keep'''
+
+    def __init__(self,maxBytes=64*2**20,minWords=2):
+        self.maxBytes=maxBytes
+        self.minWords=max(2,minWords)
+        self.entries=OrderedDict()
+        self.bytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.lock=threading.Lock()
+
+    def get(self,key):
+        '''Return the (labels, index) of the Cell kept for key, or None
+
+        :type key: tuple
+        :param key: (grammar fingerprint, pruning options, tuple of words)'''
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.entries.move_to_end(key)
+            return entry[0],entry[1]
+
+    def put(self,key,labels,index):
+        '''Keep the labels and index of a complete Cell for key'''
+        size=sys.getsizeof(key)+sys.getsizeof(key[-1])+sys.getsizeof(labels)+sys.getsizeof(index)
+        for label in labels:
+            size+=sys.getsizeof(label)
+            if label._more:
+                size+=sys.getsizeof(label._more)
+        if size>self.maxBytes:
+            return
+        with self.lock:
+            old=self.entries.pop(key,None)
+            if old is not None:
+                self.bytes-=old[2]
+            self.entries[key]=(labels,index,size)
+            self.bytes+=size
+            while self.bytes>self.maxBytes:
+                key,(labels,index,size)=self.entries.popitem(last=False)
+                self.bytes-=size
+                self.evictions+=1
+
+    def clear(self):
+        '''Drop every entry, keeping the counts'''
+        with self.lock:
+            self.entries.clear()
+            self.bytes=0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def metrics(self):
+        '''How much is kept, and how often it has been of use'''
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {"entries":len(self.entries),
+                    "bytes":self.bytes,
+                    "maxBytes":self.maxBytes,
+                    "hits":self.hits,
+                    "misses":self.misses,
+                    "hitRate":self.hits/lookups if lookups else None,
+                    "evictions":self.evictions}
+
+# What ResultCache files start with, and the version of their layout
+MAGIC=b'CKYR'
+FORMAT_VERSION=1
+
+def resultKey(compiled,tokens,beam=None,threshold=None):
+    '''The key of the result of parsing tokens with compiled in a ResultCache
+
+    :type compiled: cky_grammar.CompiledGrammar
+    :type tokens: list(str)'''
+    return (compiled.fingerprint,beam,threshold,tuple(tokens))
+
+class ResultCache:
+    '''A least recently used cache of what parsing sentences came to
+
+    The entries are the dicts returned by CKY.cachedParse, "recognised",
+    "count" and "tree" (the first tree, as a one line string), keyed by
+    resultKey, that is by the grammar's fingerprint, the pruning
+    options and the words, so one cache can serve several grammars.
+    At most maxEntries are kept.  With a path, the entries saved there
+    by save are loaded to begin with (unless the file is missing or
+    unreadable, when the cache starts empty).  It can be shared by any
+    number of CKYs and threads.
+
+    :type maxEntries: int
+    :param maxEntries: the most sentences to keep
+    :type path: str
+    :param path: the file to keep the entries in between runs, or None'''
+    FIELDS=("recognised","count","tree")
+
+    def __init__(self,maxEntries=10000,path=None):
+        self.maxEntries=maxEntries
+        self.path=path
+        self.entries=OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.lock=threading.Lock()
+        if path is not None:
+            self.load()
+
+    def get(self,key):
+        '''Return a new dict of the result kept for key, or None'''
+        with self.lock:
+            value=self.entries.get(key)
+            if value is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.entries.move_to_end(key)
+        return dict(zip(self.FIELDS,value))
+
+    def put(self,key,result):
+        '''Keep result, a dict with at least FIELDS, for key'''
+        value=tuple(result[name] for name in self.FIELDS)
+        with self.lock:
+            self.entries[key]=value
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions+=1
+
+    def load(self):
+        '''Read the entries saved in path, least recently used first, as far as
+        there is room for them'''
+        entries=readAtomic(self.path,MAGIC,FORMAT_VERSION)
+        if entries is None:
+            return
+        with self.lock:
+            for key,value in entries[max(0,len(entries)-self.maxEntries):]:
+                self.entries[key]=value
+
+    def save(self):
+        '''Write the entries to path, see cky_grammar.writeAtomic'''
+        with self.lock:
+            entries=list(self.entries.items())
+        writeAtomic(self.path,MAGIC,FORMAT_VERSION,entries)
+
+    def clear(self):
+        '''Drop every entry, keeping the counts'''
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def metrics(self):
+        '''How much is kept, and how often it has been of use'''
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {"entries":len(self.entries),
+                    "maxEntries":self.maxEntries,
+                    "hits":self.hits,
+                    "misses":self.misses,
+                    "hitRate":self.hits/lookups if lookups else None,
+                    "evictions":self.evictions}
+
+def CKY_cachedParse(self,tokens,beam=None,threshold=None,merit=None,stats=None):
+    '''Parse tokens and return what it comes to, from self.results if it has it
+
+    Unlike parse this keeps no chart, so it is safe for concurrent callers,
+    and when the ResultCache self.results (if any) has the sentence, nothing
+    is parsed at all.  Parses with a merit function are never cached, as
+    the key can't tell one function from another.
+
+    :type tokens: list(str)
+    :param tokens: the words of the sentence
+    :rtype: dict
+    :return: {"recognised": whether there is a parse, "count": how many
+      (see countParses), "tree": the first (see trees), printed on one
+      line, or None}'''
+    results=self.results
+    key=None
+    if results is not None and merit is None:
+        key=resultKey(self.compiled,tokens,beam,threshold)
+        result=results.get(key)
+        if result is not None:
+            return result
+    result={"recognised":False,"count":0,"tree":None}
+    if tokens:
+        chart=self.chartParse(tokens,beam=beam,threshold=threshold,merit=merit,stats=stats)
+        count=chart.countParses()
+        result["recognised"]=count>0
+        result["count"]=count
+        if count:
+            result["tree"]=next(chart.trees()).pformat(margin=sys.maxsize)
+    if key is not None:
+        results.put(key,result)
+    return result
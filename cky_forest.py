@@ -0,0 +1,294 @@
+'''Augment CKY with questions about the packed parse forest
+
+After parse, the labels in the chart make up a packed forest, in which
+each Label has one entry per way of building it (see Label.derivations),
+so the number of parses can be computed without enumerating them,
+and trees can be generated one at a time.
+'''
+import heapq,time
+
+def countDerivations(label,counts):
+    '''Return the number of trees rooted in label
+
+    Dynamic programming over the forest, by an explicit post-order walk
+    so deep charts can't overflow the stack.  counts memoises the result
+    for every label visited, keyed by id, and can be shared between calls.
+
+    :type label: Label
+    :type counts: dict(int,int)
+    :rtype: int'''
+    agenda=[label]
+    while agenda:
+        node=agenda[-1]
+        if id(node) in counts:
+            agenda.pop()
+            continue
+        derivations=node.derivations()
+        pending=[child for d in derivations for child in d
+                 if child is not None and id(child) not in counts]
+        if pending:
+            agenda.extend(pending)
+            continue
+        agenda.pop()
+        if not derivations:
+            counts[id(node)]=1
+            continue
+        total=0
+        for lhs,rhs in derivations:
+            if rhs is None:
+                total+=counts[id(lhs)]
+            else:
+                total+=counts[id(lhs)]*counts[id(rhs)]
+        counts[id(node)]=total
+    return counts[id(label)]
+
+def CKY_countParses(self):
+    '''Count the parses of the sentence last given to parse
+
+    That is, the number of distinct trees with the start symbol at the
+    root, counting each derivation in the packed forest once.  A unary
+    cycle is never gone round (see Cell.untangle), so what is counted
+    is the trees with no symbol repeated in a chain of unary rules,
+    whatever order the rules are written in:
+
+    >>> from cky_5 import CKY
+    >>> from cky_grammar import readGrammar
+    >>> for cycle in ("X -> Y\\nY -> X","Y -> X\\nX -> Y"):
+    ...     parser=CKY(readGrammar("S -> X\\n"+cycle+"\\nX -> 'a'\\nY -> 'a'"))
+    ...     result=parser.parse(['a'])
+    ...     print(parser.countParses(),sorted(str(t) for t in parser.trees()))
+    2 ['(S (X (Y a)))', '(S (X a))']
+    2 ['(S (X (Y a)))', '(S (X a))']
+
+    :rtype: int
+    :return: the number of parses, 0 if there are none'''
+    top=self.cell(0,self.n-1).label(self.compiled.start)
+    if top is None:
+        return 0
+    return countDerivations(top,{})
+
+def unrankTree(self,label,i,counts):
+    '''Build the i-th tree rooted in label, in derivation order
+
+    Derivation order takes label's derivations in turn, and within a
+    binary one varies the right child's tree fastest.  Counts are only
+    worked out (by countDerivations, memoised in counts) where i is not
+    0, so the first tree costs no more than building the tree itself.
+    The walk is iterative, so there is no limit on the tree's depth.
+
+    :type label: Label
+    :type i: int
+    :type counts: dict(int,int)
+    :rtype: nltk.tree.Tree'''
+    from nltk.tree import Tree
+    root=[]
+    agenda=[(label,i,root)]
+    while agenda:
+        node,i,out=agenda.pop()
+        if not node.is_parent:
+            out.append(self.compiled.name(node.symbol()))
+            continue
+        for lhs,rhs in node.derivations():
+            if i==0:
+                break
+            n=countDerivations(lhs,counts)
+            if rhs is not None:
+                n*=countDerivations(rhs,counts)
+            if i<n:
+                break
+            i-=n
+        tree=Tree(self.symbolStr(node.symbol()),[])
+        out.append(tree)
+        if rhs is None:
+            agenda.append((lhs,i,tree))
+        else:
+            li,ri=divmod(i,countDerivations(rhs,counts)) if i else (0,0)
+            # right child pushed first, so the left one is built first
+            agenda.append((rhs,ri,tree))
+            agenda.append((lhs,li,tree))
+    return root[0]
+
+class KBest:
+    '''Lazy k-best derivations of a packed forest
+
+    After Huang and Chiang (2005), Better k-best parsing, algorithm 3:
+    each node keeps the derivations found so far in best order, and a
+    heap of candidates, and the next best is only worked out when it is
+    asked for, so the k-th best tree of the root only explores the
+    parts of the forest it needs.
+
+    A derivation is (cost, d, ranks): d indexes the node's
+    Label.derivations() and ranks[j] says which best derivation of the
+    j-th child is used.  Costs add up, lower is better.'''
+
+    def __init__(self,parser,weight):
+        '''
+        :type parser: CKY
+        :param parser: the parser whose chart we are in, for symbols
+        :type weight: function
+        :param weight: called as weight(parent, children) with NLTK
+          symbols for a rule, returns its cost'''
+        self.parser=parser
+        self.weight=weight
+        self.best={}
+        self.cand={}
+        self.waiting={}
+        self.seen={}
+
+    def ruleCost(self,node,lhs,rhs):
+        symbol=self.parser.compiled.symbol
+        children=(symbol(lhs.symbol()),)
+        if rhs is not None:
+            children+=(symbol(rhs.symbol()),)
+        return self.weight(symbol(node.symbol()),children)
+
+    def cost(self,node,d,ranks):
+        '''Cost of a derivation of node, or None if a child hasn't that many
+
+        Only called once known says each child's rank is worked out'''
+        lhs,rhs=node.derivations()[d]
+        total=self.ruleCost(node,lhs,rhs)
+        for child,rank in zip((lhs,rhs),ranks):
+            found=self.best[id(child)]
+            if rank>=len(found):
+                return None
+            total+=found[rank][0]
+        return total
+
+    def known(self,node,k):
+        '''Whether the k-th best of node is worked out, or known not to exist'''
+        key=id(node)
+        found=self.best.get(key)
+        if found is None:
+            return False
+        return len(found)>k or not (self.waiting[key] or self.cand[key])
+
+    def advance(self,node,k):
+        '''Work out node's best derivations up to the k-th, as far as the
+        children allow
+
+        A candidate is costed (and goes on the heap) only once the child
+        derivations it uses are known, the others wait.
+
+        :rtype: list(tuple(Label,int))
+        :return: the (child, rank) to work out before node can go on,
+          empty once node has a k-th best or has run out'''
+        key=id(node)
+        found=self.best.get(key)
+        if found is None:
+            if not node.is_parent:
+                found=self.best[key]=[(0.0,None,())]
+                self.waiting[key]=[]
+            else:
+                found=self.best[key]=[]
+                self.waiting[key]=[(d,(0,) if rhs is None else (0,0))
+                                   for d,(lhs,rhs) in enumerate(node.derivations())]
+                self.seen[key]=set(self.waiting[key])
+            self.cand[key]=[]
+        heap=self.cand[key]
+        derivations=node.derivations()
+        while len(found)<=k:
+            wanted=[]
+            waiting=[]
+            for d,ranks in self.waiting[key]:
+                missing=[(child,rank) for child,rank in zip(derivations[d],ranks)
+                         if not self.known(child,rank)]
+                if missing:
+                    wanted.extend(missing)
+                    waiting.append((d,ranks))
+                    continue
+                cost=self.cost(node,d,ranks)
+                if cost is not None:
+                    heapq.heappush(heap,(cost,d,ranks))
+            self.waiting[key]=waiting
+            if wanted:
+                return wanted
+            if not heap:
+                return []
+            found.append(heapq.heappop(heap))
+            # the successors of the one just taken are now candidates
+            c,d,ranks=found[-1]
+            for j in range(len(ranks)):
+                succ=ranks[:j]+(ranks[j]+1,)+ranks[j+1:]
+                if (d,succ) not in self.seen[key]:
+                    self.seen[key].add((d,succ))
+                    self.waiting[key].append((d,succ))
+        return []
+
+    def kth(self,node,k):
+        '''Return the k-th best (cost, d, ranks) of node, or None
+
+        The (node, k) still wanted are kept on an explicit agenda rather
+        than by recursion down the forest, as in countDerivations, so there
+        is no limit on its depth.'''
+        agenda=[(node,k)]
+        while agenda:
+            wanted=self.advance(*agenda[-1])
+            if wanted:
+                agenda.extend(wanted)
+            else:
+                agenda.pop()
+        found=self.best[id(node)]
+        return found[k] if k<len(found) else None
+
+    def tree(self,label,k):
+        '''Build the tree of the k-th best derivation of label, iteratively'''
+        from nltk.tree import Tree
+        root=[]
+        agenda=[(label,k,root)]
+        while agenda:
+            node,k,out=agenda.pop()
+            cost,d,ranks=self.kth(node,k)
+            if d is None:
+                out.append(self.parser.compiled.name(node.symbol()))
+                continue
+            tree=Tree(self.parser.symbolStr(node.symbol()),[])
+            out.append(tree)
+            children=node.derivations()[d]
+            for child,rank in reversed(list(zip(children,ranks))):
+                agenda.append((child,rank,tree))
+        return root[0]
+
+def CKY_trees(self,k=None,weight=None):
+    '''Generate the parses of the sentence last given to parse, lazily
+
+    Trees are built one at a time as they are asked for, none are kept.
+    Without a weight they come in derivation order (see unrankTree);
+    with one, in order of increasing total cost, by lazy k-best search.
+
+    :type k: int
+    :param k: stop after this many trees, defaults to all of them
+    :type weight: function
+    :param weight: called as weight(parent, children) with the NLTK
+      symbols of a rule, returns the cost of using it
+    :rtype: iterator(nltk.tree.Tree)
+    :return: trees with the start symbol at the root'''
+    top=self.cell(0,self.n-1).label(self.compiled.start)
+    if top is None:
+        return
+    if weight is None:
+        counts={}
+        total=None
+        i=0
+        while k is None or i<k:
+            start=time.perf_counter()
+            if i==1:
+                # only count once a second tree is wanted
+                total=countDerivations(top,counts)
+            tree=unrankTree(self,top,i,counts) if i==0 or i<total else None
+            self.stats.treeTime+=time.perf_counter()-start
+            if tree is None:
+                return
+            yield tree
+            i+=1
+    else:
+        kbest=KBest(self,weight)
+        i=0
+        while k is None or i<k:
+            start=time.perf_counter()
+            tree=kbest.tree(top,i) if kbest.kth(top,i) is not None else None
+            self.stats.treeTime+=time.perf_counter()-start
+            if tree is None:
+                return
+            yield tree
+            i+=1
@@ -0,0 +1,536 @@
+'''A compiled form of a CFG for use by the CKY chart
+
+Every terminal and non-terminal is interned to a small integer once,
+when the grammar is compiled, and the rule tables are keyed by those
+integers, so the chart never has to hash nltk.grammar.Nonterminal
+objects.  Symbols are turned back into NLTK symbols only for output,
+and the tables themselves hold only names and ints, so a compiled
+grammar can be loaded and used without importing NLTK at all.
+
+Compiling a big grammar takes a while, so loadGrammar keeps compiled
+grammars in an on-disk cache, keyed by a hash of the grammar text.
+'''
+import ast,hashlib,math,os,pickle,re,tempfile
+from collections import defaultdict
+
+# Bump this whenever CompiledGrammar's tables change, so that cache
+#  files written by older code are ignored rather than misread
+FORMAT_VERSION=6
+MAGIC=b'CKYG'
+
+# How far the probabilities of a PCFG's rules for one left hand side may
+#  sum to other than 1, as nltk.PCFG.EPSILON
+EPSILON=0.01
+
+class CompiledGrammar:
+    '''Symbol tables and rule indices for a grammar of unary and binary rules
+
+    names[i] is the name of the symbol with id i, that is the word for a
+    terminal or the string a Nonterminal was made from, and terminal[i]
+    says which it is.  terminalIds and nonterminalIds map back from name
+    to id.  symbols[i] is the NLTK symbol (string or Nonterminal) with
+    id i, and ids maps back from symbol to id; these two are only made,
+    importing NLTK, the first time they are asked for.
+
+    unary maps a child id to the tuple of parent ids X with X -> child.
+
+    binaryByLeft maps a left child id to a dict from right child id to
+    the tuple of parent ids, and binaryByRight is the same the other way
+    round.  canLeft and canRight are the sets of ids which are the left
+    (resp. right) child of some binary rule.
+
+    unaryClosure maps a symbol id to everything above it in a chain of
+    unary rules, as a tuple of (ancestor id, child id, log probability)
+    triples, one per unary rule ancestor -> child whose child is either
+    the symbol itself or one of its ancestors (so with a unary cycle the
+    symbol can be an ancestor of itself).  The first triple for each
+    other ancestor has a child which comes earlier in the tuple (or is
+    the symbol), so a cell can add the whole closure in one pass,
+    building each ancestor over the label for its child; later triples
+    for the same ancestor are further derivations of it.  They are in
+    the order the old recursive unaryUpdate would have visited them.
+
+    unaryCycles is the set of unary rules, as (parent id, child id)
+    pairs, which lie on a cycle such as X -> Y, Y -> X.  A cell records
+    every derivation through them, and then cuts the cycles out of its
+    forest once it is complete (see cky_5.Cell.untangle), which would
+    otherwise give it infinitely many trees.
+
+    logProb maps a rule, as (parent id, child id) or (parent id, left
+    id, right id), to its natural log probability, which is 0.0 for
+    every rule unless the grammar is probabilistic (an nltk PCFG).
+    scoredUnary, scoredByLeft and scoredByRight are unary, binaryByLeft
+    and binaryByRight with each parent id paired with the log
+    probability of its rule.
+
+    The ids below cellSymbols are those of the non-terminals and of the
+    terminals which are children of binary rules (see renumber), the
+    only symbols whose presence in a cell matters once it is built.
+
+    The remaining tables are for recognisers which hold a cell as a
+    bitset over those ids (bit i set iff symbol i is in the cell):
+    unaryMask[i] has the bits of everything reachable from i by unary
+    rules, and of i itself if it is below cellSymbols, leftMask has the
+    bits of every symbol that is the left child of some binary rule,
+    and for such a symbol l, rightMask[l] has the bits of its possible
+    right children and binaryRight[l] is a tuple of (right id, mask of
+    parent ids).
+
+    leftCorners maps each non-terminal id to the frozenset of
+    non-terminal ids which something derived from it can begin with,
+    itself included, for prefix parsing; it is only made the first time
+    it is asked for.
+
+    fingerprint is a hex digest of the symbols and rules, in id order,
+    so two CompiledGrammars with the same one build the same charts,
+    for keying caches of parses (see cky_cache).'''
+
+    def __init__(self,productions=None,start=None):
+        '''Intern the symbols of the productions and index the rules
+
+        Without productions this makes an empty grammar, whose symbols
+        are then added with internName and rules with compile, which is
+        how readGrammar builds one without any NLTK objects.
+
+        :type productions: list(nltk.grammar.Production)
+        :param productions: unary and binary productions, with
+          probabilities if they are nltk.grammar.ProbabilisticProduction
+        :type start: nltk.grammar.Nonterminal
+        :param start: the start symbol of the grammar'''
+        self.names=[]
+        self.terminal=[]
+        self.terminalIds={}
+        self.nonterminalIds={}
+        self._symbols=None
+        self._ids=None
+        self._leftCorners=None
+        self._fingerprint=None
+        self.probabilistic=False
+        if productions is None:
+            return
+        rules=[]
+        for production in productions:
+            rhs=production.rhs()
+            assert(len(rhs)>0 and len(rhs)<=2) # Cross-checking to CNF rule that states only 1 or 2 child(ren) are allowed
+            prob=production.prob() if hasattr(production,'prob') else 1.0
+            rules.append((self.intern(production.lhs()),
+                          tuple(self.intern(s) for s in rhs),
+                          math.log(prob) if prob>0 else float('-inf')))
+        self.probabilistic=any(hasattr(p,'prob') for p in productions)
+        self.start=self.intern(start)
+        self.compile(rules)
+
+    def compile(self,rules):
+        '''Index the rules, given as (lhs id, tuple of rhs ids, log
+        probability) triples, once every symbol has been interned and
+        start set'''
+        rules=self.renumber(rules)
+        unary=defaultdict(list)
+        binary=defaultdict(list)
+        # Enough bits to hold any id, so two ids pack into one int
+        self.shift=max(1,len(self.names).bit_length())
+        self.logProb={}
+        for lhs,rhs,logProb in rules:
+            self.logProb.setdefault((lhs,)+rhs,logProb)
+            if len(rhs)==1:
+                parents=unary[rhs[0]]
+            else:
+                parents=binary[self.pack(rhs[0],rhs[1])]
+            if lhs not in parents:
+                parents.append(lhs)
+        self.unary=dict((k,tuple(v)) for k,v in unary.items())
+        self.binary=dict((k,tuple(v)) for k,v in binary.items())
+        self.binaryByLeft=defaultdict(dict)
+        self.binaryByRight=defaultdict(dict)
+        for key,parents in self.binary.items():
+            left,right=self.unpack(key)
+            self.binaryByLeft[left][right]=parents
+            self.binaryByRight[right][left]=parents
+        self.binaryByLeft=dict(self.binaryByLeft)
+        self.binaryByRight=dict(self.binaryByRight)
+        self.canLeft=frozenset(self.binaryByLeft)
+        self.canRight=frozenset(self.binaryByRight)
+        self.scoredUnary=dict((child,tuple((p,self.logProb[(p,child)]) for p in parents))
+                              for child,parents in self.unary.items())
+        self.scoredByLeft=dict((left,dict((right,tuple((p,self.logProb[(p,left,right)]) for p in parents))
+                                          for right,parents in table.items()))
+                               for left,table in self.binaryByLeft.items())
+        self.scoredByRight=dict((right,dict((left,tuple((p,self.logProb[(p,left,right)]) for p in parents))
+                                           for left,parents in table.items()))
+                                for right,table in self.binaryByRight.items())
+        self.buildClosure()
+        self.buildMasks()
+
+    def buildClosure(self):
+        '''Build unaryClosure and unaryCycles, see the class docstring'''
+        self.unaryClosure=[()]*len(self.names)
+        for i in range(len(self.names)):
+            if i not in self.unary:
+                continue
+            seen=set([i])
+            pairs=[]
+            # depth first, to match the old recursive order
+            agenda=[(parent,i) for parent in reversed(self.unary[i])]
+            while agenda:
+                parent,child=agenda.pop()
+                pairs.append((parent,child,self.logProb[(parent,child)]))
+                # i itself is in seen, so a rule back to it is the end of its chain
+                if parent not in seen:
+                    seen.add(parent)
+                    agenda.extend((p,parent) for p in reversed(self.unary.get(parent,())))
+            self.unaryClosure[i]=tuple(pairs)
+        # parent -> child is on a cycle iff child is above parent
+        self.unaryCycles=frozenset((parent,child)
+                                   for child,parents in self.unary.items()
+                                   for parent in parents
+                                   if parent==child or
+                                   any(a==child for a,c,p in self.unaryClosure[parent]))
+
+    def renumber(self,rules):
+        '''Move the non-terminals, and the terminals which are children of
+        binary rules, to the front of the symbol table, keeping their
+        order, and return rules with the new ids.  These are the symbols
+        that matter in a chart cell, and bitsets only need a bit for
+        each of them, which matters when there is a big lexicon.'''
+        n=len(self.names)
+        inCells=[not t for t in self.terminal]
+        for lhs,rhs,logProb in rules:
+            if len(rhs)==2:
+                inCells[rhs[0]]=inCells[rhs[1]]=True
+        order=[i for i in range(n) if inCells[i]]
+        self.cellSymbols=len(order)
+        order+=[i for i in range(n) if not inCells[i]]
+        if order==list(range(n)):
+            return rules
+        new=[0]*n
+        for j,i in enumerate(order):
+            new[i]=j
+        self.names=[self.names[i] for i in order]
+        self.terminal=[self.terminal[i] for i in order]
+        self.terminalIds=dict((name,new[i]) for name,i in self.terminalIds.items())
+        self.nonterminalIds=dict((name,new[i]) for name,i in self.nonterminalIds.items())
+        self.start=new[self.start]
+        return [(new[lhs],tuple(new[i] for i in rhs),logProb) for lhs,rhs,logProb in rules]
+
+    def buildMasks(self):
+        '''Build the bitset tables, see the class docstring'''
+        n=len(self.names)
+        k=self.cellSymbols
+        self.unaryMask=[0]*n
+        for i in range(n):
+            mask=1<<i if i<k else 0
+            for parent,child,logProb in self.unaryClosure[i]:
+                mask|=1<<parent
+            self.unaryMask[i]=mask
+        self.leftMask=0
+        self.rightMask=[0]*k
+        self.binaryRight=[()]*k
+        for left,table in self.binaryByLeft.items():
+            self.leftMask|=1<<left
+            right=[]
+            for r,parents in sorted(table.items()):
+                self.rightMask[left]|=1<<r
+                pmask=0
+                for parent in parents:
+                    pmask|=1<<parent
+                right.append((r,pmask))
+            self.binaryRight[left]=tuple(right)
+
+    def intern(self,symbol):
+        '''Return the id of an NLTK symbol, allocating a new one if needed'''
+        if isinstance(symbol,str):
+            return self.internName(symbol,True)
+        return self.internName(symbol.symbol(),False)
+
+    def internName(self,name,terminal):
+        '''Return the id of the terminal or non-terminal called name,
+        allocating a new one if needed'''
+        table=self.terminalIds if terminal else self.nonterminalIds
+        i=table.get(name)
+        if i is None:
+            i=table[name]=len(self.names)
+            self.names.append(name)
+            self.terminal.append(terminal)
+        return i
+
+    def pack(self,left,right):
+        '''Pack the ids of the two children of a binary rule into one int'''
+        return (left<<self.shift)|right
+
+    def unpack(self,key):
+        '''Inverse of pack, return the (left, right) pair of ids'''
+        return key>>self.shift,key&((1<<self.shift)-1)
+
+    def symbolId(self,symbol):
+        '''Return the id of symbol (a word or a Nonterminal), or None if
+        the grammar doesn't use it'''
+        if isinstance(symbol,str):
+            return self.terminalIds.get(symbol)
+        return self.nonterminalIds.get(symbol.symbol())
+
+    def symbol(self,i):
+        '''Return the NLTK symbol (string or Nonterminal) with id i'''
+        return self.symbols[i]
+
+    def name(self,i):
+        '''Return the name of the symbol with id i, as str() of the NLTK
+        symbol would, but without needing NLTK'''
+        return self.names[i]
+
+    @property
+    def symbols(self):
+        if self._symbols is None:
+            from nltk.grammar import Nonterminal
+            self._symbols=[name if terminal else Nonterminal(name)
+                           for name,terminal in zip(self.names,self.terminal)]
+        return self._symbols
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids=dict((s,i) for i,s in enumerate(self.symbols))
+        return self._ids
+
+    @property
+    def leftCorners(self):
+        if self._leftCorners is None:
+            # the first children of each non-terminal's rules
+            below=defaultdict(set)
+            for child,parents in self.unary.items():
+                for parent in parents:
+                    below[parent].add(child)
+            for key,parents in self.binary.items():
+                left=self.unpack(key)[0]
+                for parent in parents:
+                    below[parent].add(left)
+            corners={}
+            for i in self.nonterminalIds.values():
+                seen=set([i])
+                agenda=[i]
+                while agenda:
+                    for j in below[agenda.pop()]:
+                        if j not in seen and not self.terminal[j]:
+                            seen.add(j)
+                            agenda.append(j)
+                corners[i]=frozenset(seen)
+            self._leftCorners=corners
+        return self._leftCorners
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            h=hashlib.sha256()
+            h.update(('%s %s %s\n'%(FORMAT_VERSION,self.probabilistic,self.start)).encode('utf-8'))
+            for name,terminal in zip(self.names,self.terminal):
+                h.update(('%s %r\n'%('T' if terminal else 'N',name)).encode('utf-8'))
+            # in the order the rules were given, which is the order
+            #  labels are built in
+            for rule,logProb in self.logProb.items():
+                h.update(('%r %r\n'%(rule,logProb)).encode('utf-8'))
+            self._fingerprint=h.hexdigest()
+        return self._fingerprint
+
+    def __getstate__(self):
+        # Leave out the NLTK objects, they are rebuilt when needed
+        state=dict(self.__dict__)
+        state['_symbols']=None
+        state['_ids']=None
+        return state
+
+    def __len__(self):
+        return len(self.names)
+
+# One token of a grammar line: an arrow, a quoted terminal, a probability,
+#  a disjunction bar or a non-terminal, as nltk.grammar (fixed by cfg_fix)
+#  reads them
+_TOKEN_RE=re.compile(r'''\s*(?:
+    (?P<arrow> -> | \u2192 ) |
+    (?P<terminal> u?"[^"]+" | u?'[^']+' ) |
+    (?P<prob> \[ [\d\.]+ \] ) |
+    (?P<bar> \| ) |
+    (?P<nonterminal> [\w/][\w/^<>-]* ) )''',re.VERBOSE|re.UNICODE)
+
+def readGrammar(text,probabilistic=False):
+    '''Read a grammar straight into a CompiledGrammar
+
+    Accepts what parse_grammar (or nltk.PCFG.fromstring, with
+    probabilistic) does: one rule per line, with '|' between
+    alternatives, '[p]' probabilities after them, quoted terminals,
+    '#' comments, '\\' continuation lines and a '%start' directive.
+    As there, an alternative with no probability has 0, and the
+    probabilities of each left hand side's rules must sum to 1.
+    Each line is read in one pass, with no NLTK Production objects (or
+    NLTK at all), and terminals are unquoted without eval.
+
+    :type text: str or list(str)
+    :param text: the grammar
+    :type probabilistic: bool
+    :param probabilistic: read rule probabilities
+    :rtype: CompiledGrammar'''
+    lines=text.split('\n') if isinstance(text,str) else text
+    compiled=CompiledGrammar()
+    internName=compiled.internName
+    match=_TOKEN_RE.match
+    rules=[]
+    totals={}
+    start=None
+    continued=''
+    for linenum,line in enumerate(lines):
+        line=continued+line.strip()
+        if line.startswith('#') or line=='':
+            continue
+        if line.endswith('\\'):
+            continued=line[:-1].rstrip()+' '
+            continue
+        continued=''
+        if line[0]=='%':
+            directive,args=(line[1:].split(None,1)+[''])[:2]
+            m=match(args)
+            if directive!='start' or not m or not m.group('nonterminal') or m.end()!=len(args.rstrip()):
+                raise ValueError('Unable to parse line %s: %s\nBad directive'%(linenum+1,line))
+            start=m.group('nonterminal')
+            continue
+        m=match(line)
+        if not m or not m.group('nonterminal'):
+            raise ValueError('Unable to parse line %s: %s\nExpected a nonterminal'%(linenum+1,line))
+        lhs=internName(m.group('nonterminal'),False)
+        if start is None and not rules:
+            start=m.group('nonterminal')
+        m=match(line,m.end())
+        if not m or not m.group('arrow'):
+            raise ValueError('Unable to parse line %s: %s\nExpected an arrow'%(linenum+1,line))
+        pos=m.end()
+        rhs=[]
+        prob=0.0 if probabilistic else 1.0
+        while True:
+            m=match(line,pos)
+            if m is None or m.lastgroup=='bar':
+                if not rhs or len(rhs)>2:
+                    raise ValueError('Unable to parse line %s: %s\nEach alternative needs one or two symbols'%(linenum+1,line))
+                rules.append((lhs,tuple(rhs),math.log(prob) if prob>0 else float('-inf')))
+                if probabilistic:
+                    totals[lhs]=totals.get(lhs,0.0)+prob
+                if m is None:
+                    break
+                rhs=[]
+                prob=0.0 if probabilistic else 1.0
+            elif m.lastgroup=='nonterminal':
+                rhs.append(internName(m.group('nonterminal'),False))
+            elif m.lastgroup=='terminal':
+                word=m.group('terminal')
+                if '\\' in word:
+                    word=ast.literal_eval(word)
+                else:
+                    word=word[2:-1] if word[0]=='u' else word[1:-1]
+                rhs.append(internName(word,True))
+            elif m.lastgroup=='prob' and probabilistic:
+                prob=float(m.group('prob')[1:-1])
+                if prob>1.0:
+                    raise ValueError('Unable to parse line %s: %s\nProduction probability %f, should not be greater than 1.0'%(linenum+1,line,prob))
+            else:
+                raise ValueError('Unable to parse line %s: %s\nUnexpected %r'%(linenum+1,line,m.group().strip()))
+            pos=m.end()
+        if line[pos:].strip():
+            raise ValueError('Unable to parse line %s: %s\nUnexpected %r'%(linenum+1,line,line[pos:].strip()))
+    if not rules:
+        raise ValueError('No productions found!')
+    for lhs,total in totals.items():
+        if not 1-EPSILON<total<1+EPSILON:
+            raise ValueError('Productions for %s do not sum to 1'%compiled.names[lhs])
+    compiled.probabilistic=probabilistic
+    compiled.start=internName(start,False)
+    compiled.compile(rules)
+    return compiled
+
+def grammarKey(text,probabilistic=False):
+    '''Return the hex digest identifying a grammar text in the cache
+
+    :type text: str or list(str)
+    :param text: the grammar, as given to parse_grammar
+    :type probabilistic: bool
+    :param probabilistic: whether it is to be read as a PCFG'''
+    if not isinstance(text,str):
+        text='\n'.join(text)
+    h=hashlib.sha256()
+    h.update(('%s %s\n'%(FORMAT_VERSION,probabilistic)).encode('utf-8'))
+    h.update(text.encode('utf-8'))
+    return h.hexdigest()
+
+def writeAtomic(path,magic,version,payload,key=''):
+    '''Pickle payload to path, after a header of magic, version and key
+
+    It is written under a temporary name and then renamed, so a reader
+    never sees half a file.
+
+    :type magic: bytes
+    :param magic: what the kind of file starts with
+    :type version: int
+    :param version: the version of its layout
+    :type key: str
+    :param key: what else readAtomic should check, if anything'''
+    directory=os.path.dirname(os.path.abspath(path))
+    fd,tmp=tempfile.mkstemp(dir=directory,suffix='.tmp')
+    try:
+        with os.fdopen(fd,'wb') as f:
+            f.write(magic)
+            f.write(version.to_bytes(4,'big'))
+            f.write(key.encode('ascii'))
+            pickle.dump(payload,f,pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def readAtomic(path,magic,version,key=''):
+    '''Load what writeAtomic saved to path with the same magic, version and key
+
+    :return: the payload, or None if there is no such file, it can't
+      be read or its header is another'''
+    header=magic+version.to_bytes(4,'big')+key.encode('ascii')
+    try:
+        with open(path,'rb') as f:
+            if f.read(len(header))!=header:
+                return None
+            return pickle.load(f)
+    except (OSError,EOFError,pickle.UnpicklingError):
+        return None
+
+def writeCompiled(compiled,path,key):
+    '''Save a CompiledGrammar to path, marked with key
+
+    The file is a header (MAGIC, FORMAT_VERSION and key) followed by
+    the pickled tables, see writeAtomic.'''
+    writeAtomic(path,MAGIC,FORMAT_VERSION,compiled,key)
+
+def readCompiled(path,key):
+    '''Load a CompiledGrammar saved by writeCompiled
+
+    :rtype: CompiledGrammar
+    :return: the grammar, or None if there is no such file or it was
+      written by another version or for another key'''
+    return readAtomic(path,MAGIC,FORMAT_VERSION,key)
+
+def loadGrammar(text,cacheDir=None,probabilistic=False):
+    '''Compile a grammar, or load it from the cache if it has been before
+
+    :type text: str or list(str)
+    :param text: the grammar, as given to parse_grammar
+    :type cacheDir: str
+    :param cacheDir: where compiled grammars are kept, created if need
+      be; without it the grammar is just compiled
+    :type probabilistic: bool
+    :param probabilistic: read text as a PCFG, with rule probabilities
+    :rtype: CompiledGrammar'''
+    key=grammarKey(text,probabilistic)
+    path=None
+    if cacheDir is not None:
+        path=os.path.join(cacheDir,key+'.ckyg')
+        compiled=readCompiled(path,key)
+        if compiled is not None:
+            return compiled
+    compiled=readGrammar(text,probabilistic)
+    if path is not None:
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        writeCompiled(compiled,path,key)
+    return compiled
@@ -6,6 +6,8 @@ def CKY_pprint(self,cell_width=8):
     '''Try to print matrix in a nicely lined-up way'''
     row_max_height=[0]*(self.n)
     col_max_width=[0]*(self.n)
+    # cky_5 keeps its chart flat, the others in self.matrix
+    cell=getattr(self,'cell',None) or (lambda r,c:self.matrix[r][c])
     print_matrix=[]
     for r in range(self.n-1):
          # rows
@@ -15,7 +17,7 @@ def CKY_pprint(self,cell_width=8):
              if c>r:
                  # This is one we care about, get a cell form
                  #  and tabulate width, height and update maxima
-                 cf=self.matrix[r][c].str(cell_width)
+                 cf=cell(r,c).str(cell_width)
                  nlines=len(cf)
                  if nlines>row_max_height[r]:
                      row_max_height[r]=nlines
@@ -46,6 +48,18 @@ def CKY_log(self,message,*args,**kwargs):
     if self.verbose:
         print( ' '*kwargs.get('indent',0)+(message%args))
 
+# The tracing versions of two CKY methods, bound in place of maybeBuild
+#  and build by CKY.parse when verbose, so that they needn't log at all
+
+def CKY_tracedMaybeBuild(self,start,mid,end):
+    self.log("%s--%s--%s:",start, mid, end)
+    type(self).maybeBuild(self,start,mid,end)
+
+def CKY_tracedBuild(self,cell,rules,s1,s2):
+    for rule in rules:
+        self.log("%s -> %s %s", self.symbolStr(rule[0]), self.symbolStr(s1.symbol()), self.symbolStr(s2.symbol()), indent=1)
+        type(self).build(self,cell,(rule,),s1,s2)
+
 # A utility function
 def wtp(l,subrows,maxrows):
     '''figure out what row or filler from within a cell
@@ -57,7 +71,7 @@ def wtp(l,subrows,maxrows):
     else:
         return ''
 
-# Three Cell methods
+# Four Cell methods
 
 def Cell__str__(self):
     return self.str()
@@ -66,7 +80,9 @@ def Cell_str(self,width=8):
     '''Try to format labels in a rectangle,
     aiming for max-width as given, but only
     breaking between labels'''
-    syms=self.labels()
+    # Charts over a compiled grammar label with symbol ids
+    name=getattr(self.matrix,'symbolStr',str)
+    syms=[name(l.symbol()) for l in self.labels()]
     n=len(syms)
     res=[]
     if n==0:
@@ -75,7 +91,7 @@ def Cell_str(self,width=8):
     line=[]
     ll=-1
     while i<n:
-        s=str(syms[i])
+        s=syms[i]
         m=len(s)
         if ll+m>width and ll!=-1:
             res.append(' '.join(line))
@@ -90,3 +106,21 @@ def Cell_str(self,width=8):
 def Cell_log(self,message,*args,**kwargs):
     self.matrix.log("%s,%s: "+message,self._row,self._column,*args,**kwargs)
 
+def Cell_logAdded(self,first,depth=0):
+    '''Log the labels from _labels[first] on: a label just added at
+    depth, and then each unary rule tried over it and over the labels
+    built from it, one more indent for each step up the chain, as the
+    recursive unaryUpdate did'''
+    name=self.matrix.symbolStr
+    labels=self._labels
+    symbol=labels[first].symbol()
+    self.log(name(symbol),indent=depth)
+    added=set(l.symbol() for l in labels[first+1:])
+    # the indent of each label added so far, in closure order
+    depths={symbol:depth}
+    for parent,child,logProb in self.matrix.compiled.unaryClosure[symbol]:
+        if child not in depths:
+            continue
+        self.matrix.log("%s -> %s",name(parent),name(child),indent=depths[child]+1)
+        if parent in added and parent not in depths:
+            depths[parent]=depths[child]+1
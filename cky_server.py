@@ -0,0 +1,358 @@
+'''Serve parses over a local socket, as a long-lived asyncio service
+
+The grammar is loaded and compiled once, and handed to a pool of
+worker processes when they start, so a request costs only its parse.
+Clients connect to a Unix socket (or a localhost TCP port) and write
+one JSON object per line; each gets one JSON line back, with the
+same "id", as soon as it is ready, so replies can come back out of
+order when a client sends several requests without waiting:
+
+  {"id": 1, "sentence": "John gave Mary a book."}
+  {"id": 1, "recognised": true, "count": 1, "tree": "(S ...)"}
+
+"tokens" (a list of words) can be given instead of "sentence",
+which is tokenised as by cky_stream.  {"op": "health"} and
+{"op": "metrics"} are answered straight away, by the server itself.
+
+Requests arriving within window seconds of each other, up to
+maxBatch of them, go to a worker together.  The queue of requests
+waiting for a worker is bounded: when it is full the server stops
+reading from connections until there is room, which pushes back on
+clients through the socket.  A request which hasn't been answered
+within its timeout of being queued (the server's, or "timeout" in
+the request, a positive number of seconds or null for none) gets
+{"id": ..., "error": "timeout"}; a bad one gets some other error, and
+is not parsed.
+
+What each sentence came to is kept in a cky_cache.ResultCache, so a
+sentence which has been parsed before is answered straight away,
+without going to a worker; with --results-file the cache is saved
+there on shutdown and loaded again on the next start.
+
+Usage: python cky_server.py grammar-file [--unix PATH | --port N]
+         [--workers N] [--window SECONDS] [--max-batch N]
+         [--max-queue N] [--timeout SECONDS] [--cache DIR]
+         [--results N] [--results-file PATH]
+'''
+import argparse,asyncio,json,os,signal,sys,time
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor
+from cky_batch import initWorker,parseChunk
+from cky_cache import ResultCache,resultKey
+from cky_grammar import loadGrammar
+from cky_stats import ParseStats,percentile
+from cky_stream import tokenise
+
+def parseBatch(batch):
+    '''Parse a batch of tokenised sentences in a worker, started by
+    cky_batch.initWorker with the method 'cachedParse'
+
+    Each sentence goes into a Chart of its own, so with workers=0 any
+    number of batches can be parsed at once, on threads.
+
+    :type batch: list(list(str))
+    :rtype: tuple
+    :return: (replies, stats) with a reply dict for each sentence and
+      the ParseStats of the whole batch'''
+    stats=ParseStats()
+    replies=parseChunk(batch,stats=stats)
+    return replies,stats
+
+class ParseServer:
+    '''A parser behind an asyncio socket server, see the module docstring
+
+    :type compiled: cky_grammar.CompiledGrammar
+    :param compiled: the grammar
+    :type workers: int
+    :param workers: how many worker processes, defaults to one per CPU;
+      0 parses on threads in this process instead
+    :type window: float
+    :param window: how long in seconds to wait for more requests to
+      batch with the first one
+    :type maxBatch: int
+    :param maxBatch: the most requests in a batch
+    :type maxQueue: int
+    :param maxQueue: the most requests waiting for a worker
+    :type timeout: float
+    :param timeout: seconds a request may take, unless it says otherwise
+    :type results: cky_cache.ResultCache
+    :param results: where to look for sentences before parsing them, and
+      keep them after, or None'''
+
+    def __init__(self,compiled,workers=None,window=0.005,maxBatch=32,
+                 maxQueue=1024,timeout=10.0,results=None):
+        self.compiled=compiled
+        if workers is None:
+            workers=os.cpu_count() or 1
+        self.workers=workers
+        self.window=window
+        self.maxBatch=maxBatch
+        self.maxQueue=maxQueue
+        self.timeout=timeout
+        self.results=results
+        self.started=time.time()
+        self.requests=0
+        self.replies=0
+        self.errors=0
+        self.timeouts=0
+        self.batches=0
+        self.batched=0
+        # latencies of the most recent replies, for the metrics
+        self.latencies=[]
+        self.stats=ParseStats()
+        # the handle tasks of the open connections
+        self.connections=set()
+
+    async def start(self,path=None,host='127.0.0.1',port=None):
+        '''Start the workers and the batcher, and listen on the Unix socket
+        path, or else on host and port
+
+        :rtype: asyncio.AbstractServer'''
+        if self.workers:
+            self.executor=ProcessPoolExecutor(self.workers,initializer=initWorker,
+                                              initargs=(self.compiled,'cachedParse'))
+        else:
+            initWorker(self.compiled,'cachedParse')
+            self.executor=ThreadPoolExecutor(os.cpu_count() or 1)
+        self.queue=asyncio.Queue(self.maxQueue)
+        # one batch in hand per worker, the rest wait in the queue
+        self.slots=asyncio.Semaphore(max(self.workers,1))
+        self.batcher=asyncio.ensure_future(self.batchLoop())
+        if path is not None:
+            self.server=await asyncio.start_unix_server(self.handle,path)
+        else:
+            self.server=await asyncio.start_server(self.handle,host,port)
+        return self.server
+
+    async def close(self):
+        '''Stop listening, close the connections still open, shut down the
+        batcher and the workers, and save the results if they have a file'''
+        self.server.close()
+        for task in self.connections:
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(self.connections)
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown()
+        if self.results is not None and self.results.path is not None:
+            self.results.save()
+
+    async def handle(self,reader,writer):
+        '''Read requests from one connection, answering each as it is ready'''
+        lock=asyncio.Lock()
+        pending=set()
+        connection=asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            while True:
+                line=await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                self.requests+=1
+                try:
+                    request=json.loads(line.decode('utf-8'))
+                    if not isinstance(request,dict):
+                        raise ValueError("not an object")
+                except ValueError as e:
+                    await self.reply(writer,lock,{"id":None,"error":"bad request: %s"%e})
+                    continue
+                if request.get("op") is not None:
+                    await self.reply(writer,lock,self.operation(request))
+                    continue
+                try:
+                    tokens=self.tokens(request)
+                    timeout=self.timeLimit(request)
+                except ValueError as e:
+                    await self.reply(writer,lock,{"id":request.get("id"),"error":str(e)})
+                    continue
+                if self.results is not None:
+                    found=self.results.get(resultKey(self.compiled,tokens))
+                    if found is not None:
+                        found["id"]=request.get("id")
+                        await self.reply(writer,lock,found)
+                        continue
+                future=asyncio.get_event_loop().create_future()
+                # Waits here while the queue is full, so nothing more is
+                #  read from this connection until there is room
+                await self.queue.put((tokens,future))
+                task=asyncio.ensure_future(self.answer(request,timeout,future,writer,lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError,asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # by close, so drop what is left and end quietly: a handler which
+            #  ends cancelled gets a traceback logged by asyncio
+            for task in pending:
+                task.cancel()
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+
+    def tokens(self,request):
+        '''The tokens a request asks to be parsed'''
+        if "tokens" in request:
+            tokens=request["tokens"]
+            if not (isinstance(tokens,list) and all(isinstance(t,str) for t in tokens)):
+                raise ValueError("tokens must be a list of strings")
+            return tokens
+        if isinstance(request.get("sentence"),str):
+            return tokenise(request["sentence"])
+        raise ValueError("no sentence or tokens")
+
+    def timeLimit(self,request):
+        '''The seconds a request may take, or None for no limit'''
+        if "timeout" not in request:
+            return self.timeout
+        timeout=request["timeout"]
+        if timeout is None:
+            return None
+        if isinstance(timeout,bool) or not isinstance(timeout,(int,float)) or not timeout>0:
+            raise ValueError("timeout must be a positive number or null")
+        return timeout
+
+    async def answer(self,request,timeout,future,writer,lock):
+        '''Wait for the parse of a request, and reply with it, or with a
+        timeout if it takes longer than timeout seconds'''
+        start=time.time()
+        reply={"id":request.get("id")}
+        try:
+            reply.update(await asyncio.wait_for(future,timeout))
+        except asyncio.TimeoutError:
+            self.timeouts+=1
+            reply["error"]="timeout"
+        except Exception as e:
+            reply["error"]="%s: %s"%(type(e).__name__,e)
+        if "error" not in reply:
+            self.latencies.append(time.time()-start)
+            if len(self.latencies)>10000:
+                del self.latencies[:5000]
+        await self.reply(writer,lock,reply)
+
+    async def reply(self,writer,lock,reply):
+        if "error" in reply:
+            self.errors+=1
+        else:
+            self.replies+=1
+        async with lock:
+            writer.write((json.dumps(reply)+'\n').encode('utf-8'))
+            await writer.drain()
+
+    async def batchLoop(self):
+        '''Take requests off the queue in batches and hand them to workers'''
+        loop=asyncio.get_event_loop()
+        while True:
+            await self.slots.acquire()
+            batch=[await self.queue.get()]
+            deadline=loop.time()+self.window
+            while len(batch)<self.maxBatch:
+                wait=deadline-loop.time()
+                if wait<=0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),wait))
+                except asyncio.TimeoutError:
+                    break
+            # requests which timed out while they waited needn't be parsed
+            batch=[(tokens,future) for tokens,future in batch if not future.done()]
+            if not batch:
+                self.slots.release()
+                continue
+            self.batches+=1
+            self.batched+=len(batch)
+            work=loop.run_in_executor(self.executor,parseBatch,[tokens for tokens,future in batch])
+            work.add_done_callback(lambda work,batch=batch:self.finish(work,batch))
+
+    def finish(self,work,batch):
+        '''Pass the results of a batch on to the requests waiting for them'''
+        self.slots.release()
+        try:
+            replies,stats=work.result()
+        except Exception as e:
+            for tokens,future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats.add(stats)
+        for (tokens,future),reply in zip(batch,replies):
+            if self.results is not None:
+                self.results.put(resultKey(self.compiled,tokens),reply)
+            if not future.done():
+                future.set_result(reply)
+
+    def operation(self,request):
+        '''Answer a request with an "op"'''
+        op=request["op"]
+        reply={"id":request.get("id")}
+        if op=="health":
+            reply.update(status="ok",uptime=time.time()-self.started,
+                         workers=self.workers,queued=self.queue.qsize())
+        elif op=="metrics":
+            reply.update(self.metrics())
+        else:
+            reply["error"]="unknown op %r"%op
+        return reply
+
+    def metrics(self):
+        '''Counts of what the server has done, and latencies in seconds of the
+        requests which were parsed'''
+        return {"requests":self.requests,
+                "replies":self.replies,
+                "errors":self.errors,
+                "timeouts":self.timeouts,
+                "queued":self.queue.qsize(),
+                "batches":self.batches,
+                "meanBatch":self.batched/self.batches if self.batches else None,
+                "p50":percentile(self.latencies,50),
+                "p99":percentile(self.latencies,99),
+                "parse":self.stats.asDict(),
+                "results":self.results.metrics() if self.results is not None else None}
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('grammar',help='the grammar file')
+    parser.add_argument('--unix',help='listen on this Unix socket')
+    parser.add_argument('--port',type=int,default=8377,help='else on this localhost port')
+    parser.add_argument('--workers',type=int,default=None,
+                        help='worker processes, defaults to one per CPU; 0 for threads')
+    parser.add_argument('--window',type=float,default=0.005)
+    parser.add_argument('--max-batch',type=int,default=32)
+    parser.add_argument('--max-queue',type=int,default=1024)
+    parser.add_argument('--timeout',type=float,default=10.0)
+    parser.add_argument('--cache',help='directory to cache the compiled grammar in')
+    parser.add_argument('--results',type=int,default=10000,
+                        help='how many sentences to remember the results of, 0 for none')
+    parser.add_argument('--results-file',help='keep the results in this file between runs')
+    args=parser.parse_args(argv)
+    with open(args.grammar) as f:
+        compiled=loadGrammar(f.read(),args.cache)
+    results=None
+    if args.results:
+        results=ResultCache(args.results,args.results_file)
+    server=ParseServer(compiled,args.workers,args.window,args.max_batch,
+                       args.max_queue,args.timeout,results)
+    loop=asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start(args.unix,port=None if args.unix else args.port))
+    print("listening on %s"%(args.unix or "127.0.0.1:%d"%args.port))
+    sys.stdout.flush()
+    # Stop the loop between callbacks on ^C, rather than have the
+    #  KeyboardInterrupt raised in whichever task happens to be running
+    try:
+        loop.add_signal_handler(signal.SIGINT,loop.stop)
+        loop.add_signal_handler(signal.SIGTERM,loop.stop)
+    except NotImplementedError:
+        pass
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,76 @@
+'''Counters and timings for CKY.parse
+
+Every parse fills in a ParseStats, left in CKY.stats.  The counts are
+kept by the engine as it goes, one addition per cell, split or rule hit
+at most, so they cost next to nothing and needn't be turned off.  To
+total a batch, pass the same ParseStats to every parse, or add up the
+ones from separate parses (or processes) with + or add.
+'''
+import math
+
+class ParseStats:
+    '''What one or more calls of CKY.parse did, and how long it took
+
+    sentences, words: how many were parsed
+    cells: spans which got a Cell, because there was something to build
+      there (the others have nothing in them, see cky_5.EMPTY)
+    splits: (start, mid, end) splits tried
+    pairs: (left label, right label) pairs looked up in the binary rules
+    binaryHits: labels built by binary rules, one per rule per pair
+    unaryClosures: labels whose unary closure was walked
+    peakLabels: the most labels in any one Cell, before pruning
+    fillTime, scanTime: wall time in seconds of unaryFill and binaryScan
+      (or their parts in Chart.addToken)
+    treeTime: wall time in seconds spent building trees afterwards,
+      by firstTree or trees'''
+    __slots__=('sentences','words','cells','splits','pairs','binaryHits',
+               'unaryClosures','peakLabels','fillTime','scanTime','treeTime')
+
+    # fields which are totalled when stats are added, the rest take the max
+    TOTALS=('sentences','words','cells','splits','pairs','binaryHits',
+            'unaryClosures','fillTime','scanTime','treeTime')
+
+    def __init__(self,**fields):
+        for name in self.__slots__:
+            setattr(self,name,fields.get(name,0))
+
+    def add(self,other):
+        '''Add the counts and timings of other into these, in place
+
+        :type other: ParseStats
+        :rtype: ParseStats
+        :return: self'''
+        for name in self.TOTALS:
+            setattr(self,name,getattr(self,name)+getattr(other,name))
+        self.peakLabels=max(self.peakLabels,other.peakLabels)
+        return self
+
+    def __add__(self,other):
+        return ParseStats().add(self).add(other)
+
+    def __radd__(self,other):
+        # so that sum(stats) works, starting from 0
+        if other==0:
+            return self
+        return NotImplemented
+
+    def asDict(self):
+        '''The fields as a dict, e.g. for JSON'''
+        return dict((name,getattr(self,name)) for name in self.__slots__)
+
+    def __getstate__(self):
+        return self.asDict()
+
+    def __setstate__(self,state):
+        for name in self.__slots__:
+            setattr(self,name,state.get(name,0))
+
+    def __repr__(self):
+        return 'ParseStats(%s)'%', '.join('%s=%r'%item for item in self.asDict().items())
+
+def percentile(values,p):
+    '''The p-th percentile of values, by nearest rank, or None if there are none'''
+    if not values:
+        return None
+    values=sorted(values)
+    return values[max(0,int(math.ceil(p/100.0*len(values)))-1)]
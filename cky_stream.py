@@ -0,0 +1,75 @@
+'''Parse a corpus as a stream, one sentence per line
+
+Each line is tokenised, parsed and its result written out before the
+next line is read, and the chart is dropped as soon as the result has
+been taken from it, so memory use doesn't grow with the corpus.
+
+Usage: python cky_stream.py grammar-file [corpus [output]]
+with the corpus and output defaulting to stdin and stdout.
+'''
+import re,sys
+from cky_5 import CKY
+from cky_grammar import loadGrammar
+
+def tokenise(tokenstring):
+  '''Split a string into a list of tokens, as in hw2
+
+  We treat punctuation as
+  separate tokens, and split contractions into their parts.
+
+  :type tokenstring: str
+  :param tokenstring: the string to be tokenised
+  :rtype: list(str)
+  :return: the tokens found in tokenstring'''
+  return re.findall(
+        r"[-\w]+|'\w+|[^-\w\s]+",
+        tokenstring,
+        re.U
+        )
+
+def parseLine(chart,line):
+    '''Parse one line of the corpus
+
+    :type chart: CKY
+    :type line: str
+    :rtype: str
+    :return: the tab-separated output line: whether the sentence was
+      recognised, how many parses it has and its first parse, bracketed
+      on one line (empty if there is none)'''
+    tokens=tokenise(line)
+    if not tokens:
+        return "False\t0\t\n"
+    chart.parse(tokens)
+    count=chart.countParses()
+    tree=''
+    if count:
+        tree=next(chart.trees()).pformat(margin=sys.maxsize)
+    chart.clear()
+    return "%s\t%s\t%s\n"%(count>0,count,tree)
+
+def parseCorpus(grammar,infile,outfile):
+    '''Parse every line of infile, writing one line per sentence to outfile
+
+    :type grammar: nltk.grammar.CFG, CompiledGrammar or CKY
+    :param grammar: the grammar to parse with
+    :type infile: file
+    :param infile: the corpus, one sentence per line
+    :type outfile: file
+    :param outfile: where the results go, see parseLine, each line
+      flushed as soon as it is written
+    :rtype: int
+    :return: the number of sentences parsed'''
+    chart=grammar if isinstance(grammar,CKY) else CKY(grammar)
+    n=0
+    for line in infile:
+        outfile.write(parseLine(chart,line))
+        outfile.flush()
+        n+=1
+    return n
+
+if __name__=='__main__':
+    with open(sys.argv[1]) as f:
+        grammar=loadGrammar(f.read())
+    infile=open(sys.argv[2]) if len(sys.argv)>2 else sys.stdin
+    outfile=open(sys.argv[3],'w') if len(sys.argv)>3 else sys.stdout
+    parseCorpus(grammar,infile,outfile)
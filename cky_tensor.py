@@ -0,0 +1,90 @@
+'''Augment CKY with a NumPy engine for the binary scan
+
+The chart is a boolean array of shape (n, n+1, cellSymbols), and all the
+cells of one span length are built at once, as a contraction of their
+left and right children against a binary-rule tensor, followed by the
+unary closure as a matrix product.
+
+NumPy is only needed if this engine is used, so it is imported on the
+first call rather than when cky_5 is loaded.
+'''
+
+def buildTensors(compiled):
+    '''Build the rule tensors for a CompiledGrammar
+
+    Only symbols that occur as a left (resp. right) child of some
+    binary rule get a row (resp. column) of the binary tensor, which
+    keeps it small when there are many terminals.
+
+    :type compiled: cky_grammar.CompiledGrammar
+    :rtype: tuple
+    :return: (left ids, right ids, binary, closure) where
+      binary[i*len(right ids)+j,p] is 1 iff p -> left ids[i] right ids[j]
+      and closure[c,p] is 1 iff p is c or reachable from c by unary
+      rules; both only have a column for each of the ids below
+      compiled.cellSymbols, and closure a row for each of them too'''
+    import numpy as np
+    n=compiled.cellSymbols
+    shift=compiled.shift
+    rmask=(1<<shift)-1
+    lefts=sorted(set(k>>shift for k in compiled.binary))
+    rights=sorted(set(k&rmask for k in compiled.binary))
+    lpos=dict((l,i) for i,l in enumerate(lefts))
+    rpos=dict((r,j) for j,r in enumerate(rights))
+    binary=np.zeros((len(lefts)*len(rights),n),dtype=np.float32)
+    for key,parents in compiled.binary.items():
+        row=lpos[key>>shift]*len(rights)+rpos[key&rmask]
+        binary[row,list(parents)]=1
+    closure=np.zeros((n,n),dtype=np.float32)
+    for c in range(n):
+        closure[c,maskIds(compiled.unaryMask[c],n)]=1
+    return (np.array(lefts,dtype=np.intp),np.array(rights,dtype=np.intp),
+            binary,closure)
+
+def maskIds(mask,n):
+    '''The ids below n whose bits are set in mask'''
+    return [i for i in range(n) if (mask>>i)&1]
+
+def CKY_tensorParse(self,tokens):
+    '''Recognise tokens with the NumPy engine
+
+    Gives the same result as parse, but without building any Cell or
+    Label objects, so there are no trees to be had afterwards.
+
+    :type tokens: list(str)
+    :param tokens: the words of the sentence
+    :rtype: tuple
+    :return: (result, labels) where result is what parse would return
+      (the number of labels in the top cell, or False) and labels is
+      the list of NLTK symbols in the top cell'''
+    import numpy as np
+    if getattr(self,'tensors',None) is None:
+        self.tensors=buildTensors(self.compiled)
+    lefts,rights,binary,closure=self.tensors
+    g=self.compiled
+    n=len(tokens)
+    if n==0:
+        return False,[]
+    chart=np.zeros((n,n+1,g.cellSymbols),dtype=np.float32)
+    for r in range(n):
+        i=g.symbolId(tokens[r])
+        if i is not None:
+            chart[r,r+1,maskIds(g.unaryMask[i],g.cellSymbols)]=1
+    for span in range(2,n+1):
+        starts=np.arange(n-span+1)[:,None]
+        mids=starts+np.arange(1,span)[None,:]
+        # (starts, mids, symbols) for the left and right children
+        left=chart[starts,mids][:,:,lefts]
+        right=chart[mids,starts+span][:,:,rights]
+        # which (left, right) pairs meet at some mid, for each start
+        pairs=np.matmul(left.transpose(0,2,1),right)
+        built=pairs.reshape(len(starts),-1).dot(binary)>0
+        cells=built.astype(np.float32).dot(closure)>0
+        chart[starts[:,0],starts[:,0]+span]=cells
+    top=[g.symbol(i) for i in np.flatnonzero(chart[0,n])]
+    if n==1:
+        # a word with no bit of its own is still in its cell
+        i=g.symbolId(tokens[0])
+        if i is not None and i>=g.cellSymbols:
+            top.append(tokens[0])
+    return (len(top) or False),top
@@ -0,0 +1,105 @@
+'''Augment CKY with Viterbi parsing for probabilistic grammars
+
+Each cell keeps just the best log probability and one backpointer per
+symbol, so the time taken doesn't depend on how ambiguous the sentence
+is, only on its length and the grammar.  The rule probabilities are the
+ones cfg_fix.fix_parse_production reads for an nltk PCFG, as compiled
+into CompiledGrammar.logProb.
+'''
+
+def unaryRelax(cell,scoredUnary):
+    '''Extend cell with the best way of building everything above what
+    is in it by unary rules.  With log probabilities no greater than 0
+    going round a unary cycle can't improve a score, so this stops.'''
+    agenda=list(cell)
+    while agenda:
+        child=agenda.pop()
+        rules=scoredUnary.get(child)
+        if rules is None:
+            continue
+        score=cell[child][0]
+        for parent,logProb in rules:
+            s=score+logProb
+            old=cell.get(parent)
+            if old is None or s>old[0]:
+                cell[parent]=(s,(child,))
+                agenda.append(parent)
+
+def CKY_viterbiParse(self,tokens):
+    '''Find the most probable parse of tokens
+
+    For a grammar without probabilities every rule has log probability
+    0.0, so this finds some parse.
+
+    :type tokens: list(str)
+    :param tokens: the words of the sentence
+    :rtype: tuple(nltk.tree.Tree, float)
+    :return: the best tree with the start symbol at the root and its
+      natural log probability, or None if there is no parse'''
+    g=self.compiled
+    n=len(tokens)
+    if n==0:
+        return None
+    scoredUnary=g.scoredUnary
+    scoredByLeft=g.scoredByLeft
+    canRight=g.canRight
+    # chart[start][end] maps symbol id to (log prob, backpointer), where
+    #  the backpointer is () for a word, (child,) for a unary rule and
+    #  (mid, left, right) for a binary one
+    chart=[[None]*(n+1) for r in range(n)]
+    for r in range(n):
+        cell={}
+        i=g.symbolId(tokens[r])
+        if i is not None:
+            cell[i]=(0.0,())
+            unaryRelax(cell,scoredUnary)
+        chart[r][r+1]=cell
+    for span in range(2,n+1):
+        for start in range(n-span+1):
+            end=start+span
+            cell={}
+            for mid in range(start+1,end):
+                rights=[(r,v[0]) for r,v in chart[mid][end].items() if r in canRight]
+                if not rights:
+                    continue
+                for l,(ls,lb) in chart[start][mid].items():
+                    table=scoredByLeft.get(l)
+                    if table is None:
+                        continue
+                    for r,rs in rights:
+                        rules=table.get(r)
+                        if rules is None:
+                            continue
+                        for parent,logProb in rules:
+                            s=ls+rs+logProb
+                            old=cell.get(parent)
+                            if old is None or s>old[0]:
+                                cell[parent]=(s,(mid,l,r))
+            unaryRelax(cell,scoredUnary)
+            chart[start][end]=cell
+    best=chart[0][n].get(g.start)
+    if best is None:
+        return None
+    return viterbiTree(self,chart,0,n,g.start),best[0]
+
+def viterbiTree(self,chart,start,end,symbol):
+    '''Build the tree for symbol over start..end from the backpointers,
+    with an explicit stack rather than recursion'''
+    from nltk.tree import Tree
+    root=[]
+    agenda=[(start,end,symbol,root)]
+    while agenda:
+        start,end,symbol,out=agenda.pop()
+        back=chart[start][end][symbol][1]
+        if not back:
+            out.append(self.compiled.name(symbol))
+            continue
+        tree=Tree(self.symbolStr(symbol),[])
+        out.append(tree)
+        if len(back)==1:
+            agenda.append((start,end,back[0],tree))
+        else:
+            mid,left,right=back
+            agenda.append((mid,end,right,tree))
+            agenda.append((start,mid,left,tree))
+    return root[0]